@@ -0,0 +1,112 @@
+"""
+This module implements a persistent store (sqlite file) for the data retrieved from trident Knowledge Base.
+For each freebase_id it keeps the english abstracts and the nouns extracted from them.
+Candidates without english abstract are stored with an empty list of abstracts (negative result).
+Without a file the store is a bounded in-memory LRU, like the memory tier of cache.py.
+"""
+
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# number of writes after which the store is committed
+COMMIT_EVERY = 100
+
+
+class AbstractStore(object):
+    """
+    freebase_id -> (english abstracts, kb_nouns) store
+    """
+
+    def __init__(self, filename=None, max_size=100000):
+        """
+        :param filename: the path to the sqlite file. If None the store is kept only in memory
+        :param max_size: the maximum number of freebase_ids kept in memory (only without filename, the least
+         recently used are evicted)
+        """
+        self.filename = filename
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.pending_writes = 0
+        self.memory = OrderedDict()
+        self.connection = None
+        if filename:
+            self.connection = sqlite3.connect(filename, check_same_thread=False)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS abstracts "
+                                    "(freebase_id TEXT PRIMARY KEY, abstracts TEXT, nouns TEXT)")
+            self.connection.commit()
+
+    def __len__(self):
+        return len(self.memory)
+
+    def get(self, freebase_id):
+        """
+        Finds the stored data of a candidate
+        :param freebase_id: the freebase_id of a candidate as returned from elastic search
+        :return: a tuple (abstracts, nouns) or None if the candidate is not stored.
+         abstracts is an empty list if the candidate does not have an english abstract
+         nouns is None if the nouns have not been extracted yet
+        """
+        with self.lock:
+            if self.connection is None:
+                if freebase_id not in self.memory:
+                    self.misses += 1
+                    return None
+                # move the entry at the end (most recently used)
+                abstracts, nouns = self.memory.pop(freebase_id)
+                self.memory[freebase_id] = abstracts, nouns
+                self.hits += 1
+                return list(abstracts), list(nouns) if nouns is not None else None
+
+            row = self.connection.execute("SELECT abstracts, nouns FROM abstracts WHERE freebase_id = ?",
+                                          (freebase_id,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            abstracts, nouns = row
+            return json.loads(abstracts), json.loads(nouns) if nouns is not None else None
+
+    def put(self, freebase_id, abstracts, nouns=None):
+        """
+        Stores the data of a candidate
+        :param freebase_id: the freebase_id of a candidate as returned from elastic search
+        :param abstracts: list with the english abstracts (empty list if the candidate has not english abstract)
+        :param nouns: list with the nouns extracted from the abstracts
+        :return: None
+        """
+        with self.lock:
+            if self.connection is None:
+                self.memory.pop(freebase_id, None)
+                self.memory[freebase_id] = list(abstracts), list(nouns) if nouns is not None else None
+                if len(self.memory) > self.max_size:
+                    self.memory.popitem(last=False)
+                return
+
+            self.connection.execute("INSERT OR REPLACE INTO abstracts (freebase_id, abstracts, nouns) VALUES (?, ?, ?)",
+                                    (freebase_id, json.dumps(abstracts),
+                                     json.dumps(list(nouns)) if nouns is not None else None))
+            self.pending_writes += 1
+            if self.pending_writes >= COMMIT_EVERY:
+                self.connection.commit()
+                self.pending_writes = 0
+
+    def stats(self):
+        """
+        :return: a dictionary with the hit/miss counters of the store
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.memory)}
+
+    def close(self):
+        """
+        Commits the pending writes and closes the store
+        :return: None
+        """
+        with self.lock:
+            if self.connection is not None:
+                self.connection.commit()
+                self.connection.close()
+                self.connection = None
@@ -0,0 +1,430 @@
+"""
+Offline benchmark of the entity linking pipeline.
+It contains:
+- a generator of synthetic (gzipped) warc files with configurable size and mention density
+- local stand-ins of elastic search (/freebase/label/_search, /freebase/label/_msearch) and trident (/sparql) with
+  configurable latency
+- a runner that links a warc file as linker.main does (in its LINKING_MODE, with the output discarded) and reports
+  documents/sec, mentions/sec and the time of each stage of the metrics, and saves the results as json
+
+Usage:
+    python benchmark.py generate OUTPUT.warc.gz [--documents 100] [--words 500] [--mention-density 0.1]
+    python benchmark.py run WARC_FILE [--es-latency 0.005] [--trident-latency 0.05] [--output results.json]
+        [--linking-mode sequential|concurrent|pipeline]
+    python benchmark.py compare BASELINE.json RESULTS.json
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+
+import warc_index
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+# syllables of the synthetic entity names
+SYLLABLES = ["ka", "lo", "mer", "dan", "vi", "ro", "tes", "nal", "bu", "gor", "shi", "pel", "tam", "ur", "zen", "ox"]
+# words of the synthetic text
+COMMON_WORDS = ["the", "of", "and", "to", "in", "is", "was", "for", "on", "with", "as", "by", "at", "from", "that",
+                "city", "company", "people", "year", "team", "music", "house", "river", "game", "school", "world"]
+
+# number of hits of the elastic search stand-in for each query
+ES_HITS = 100
+# number of distinct freebase ids of the stand-ins
+KB_SIZE = 20000
+# number of entity names of each topic. The mentions of a document and the names of an abstract are mostly from one
+# topic, so the best candidates of a mention share many nouns with the document
+TOPIC_SIZE = 50
+# fraction of the mentions of a document (and of the names of an abstract) that are from its topic
+TOPIC_FRACTION = 0.8
+# number of hits of each query whose abstract is about the topic of the query
+TOPIC_HITS = 5
+
+
+########################################################
+#               synthetic warc generator               #
+########################################################
+def entity_names(count, seed=0):
+    """
+    Generates synthetic entity names (e.g. "Kalo Merdan")
+    :param count: the number of names
+    :param seed: seed of the random generator
+    :return: list of strings
+    """
+    generator = random.Random(seed)
+    names = set()
+    while len(names) < count:
+        words = []
+        for _ in range(generator.choice([1, 2, 2, 3])):
+            word = "".join(generator.choice(SYLLABLES) for _ in range(generator.randint(2, 3)))
+            words.append(word.capitalize())
+        names.add(" ".join(words))
+    return sorted(names)
+
+
+def sentence_case(text):
+    """
+    Capitalizes the first character of a text (the other characters are not changed)
+    """
+    return text[:1].upper() + text[1:]
+
+
+def topic_names(names, topic):
+    """
+    :param names: the entity names
+    :param topic: the number of the topic
+    :return: the entity names of the topic
+    """
+    return names[topic * TOPIC_SIZE:(topic + 1) * TOPIC_SIZE]
+
+
+def topic_count(names):
+    return max(1, len(names) // TOPIC_SIZE)
+
+
+def choose_name(generator, names, topic):
+    """
+    Chooses an entity name, from the topic with probability TOPIC_FRACTION
+    """
+    if generator.random() < TOPIC_FRACTION:
+        return generator.choice(topic_names(names, topic))
+    return generator.choice(names)
+
+
+def generate_document(generator, names, words, mention_density):
+    """
+    Generates the html of a synthetic document
+    :param generator: random generator
+    :param names: the entity names
+    :param words: the number of words of the document
+    :param mention_density: the fraction of the words that are entity mentions
+    :return: string
+    """
+    topic = generator.randrange(topic_count(names))
+    paragraphs = []
+    sentence = []
+    for _ in range(words):
+        if generator.random() < mention_density:
+            sentence.append(choose_name(generator, names, topic))
+        else:
+            sentence.append(generator.choice(COMMON_WORDS))
+        if len(sentence) >= 15:
+            paragraphs.append("<p>{}.</p>".format(sentence_case(" ".join(sentence))))
+            sentence = []
+    if sentence:
+        paragraphs.append("<p>{}.</p>".format(sentence_case(" ".join(sentence))))
+    return ("<html><head><title>Synthetic</title><script>var x = 1;</script></head>"
+            "<body>{}<!-- comment --></body></html>".format("\n".join(paragraphs)))
+
+
+def warc_record(headers, body):
+    """
+    Builds a warc record
+    :param headers: list of tuples (name, value)
+    :param body: bytes
+    :return: bytes
+    """
+    lines = ["WARC/1.0"] + ["{}: {}".format(name, value) for name, value in headers]
+    lines.append("Content-Length: {}".format(len(body)))
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8") + body + b"\r\n\r\n"
+
+
+def generate_warc(filename, documents=100, words=500, mention_density=0.1, entities=2000, seed=0):
+    """
+    Writes a synthetic gzipped warc file
+    :param filename: the path of the warc file
+    :param documents: the number of documents (response records)
+    :param words: the number of words of each document
+    :param mention_density: the fraction of the words that are entity mentions
+    :param entities: the number of distinct entity names
+    :param seed: seed of the random generator
+    :return: None
+    """
+    generator = random.Random(seed)
+    names = entity_names(entities, seed)
+    with open(filename, "wb") as warc_file:
+        warc_file.write(warc_index.gzip_member(warc_record([("WARC-Type", "warcinfo")], b"software: benchmark.py\r\n")))
+        for number in range(documents):
+            html = generate_document(generator, names, words, mention_density).encode("utf-8")
+            http = b"HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=UTF-8\r\n\r\n" + html
+            headers = [("WARC-Type", "response"),
+                       ("WARC-TREC-ID", "clueweb12-0000bm-00-{:05d}".format(number)),
+                       ("WARC-Target-URI", "http://benchmark.example/{}".format(number))]
+            warc_file.write(warc_index.gzip_member(warc_record(headers, http)))
+
+
+########################################################
+#          elastic search and trident stand-ins        #
+########################################################
+def stable_hash(text):
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest()[:12], 16)
+
+
+def fake_hits(query, topics, count):
+    """
+    Deterministic hits of the elastic search stand-in. The first TOPIC_HITS hits of an entity name are ids of its topic.
+    :param query: string
+    :param topics: dictionary {lowercase entity name: topic}
+    :param count: the number of topics
+    :return: the response of _search
+    """
+    seed = stable_hash(query.lower())
+    topic = topics.get(query.lower())
+    hits = []
+    for rank in range(ES_HITS):
+        number = (seed + rank * 7919) % KB_SIZE
+        if topic is not None and rank < TOPIC_HITS:
+            # an id whose abstract is about the topic (see fake_abstracts)
+            number = number - number % count + topic
+        hits.append({"_score": round(10.0 - rank * 0.05 - (seed % 13) * 0.001, 4),
+                     "_source": {"resource": "/m/0{:x}".format(number), "label": query}})
+    return {"hits": {"total": ES_HITS, "hits": hits}}
+
+
+def fake_abstracts(freebase_uri, names):
+    """
+    Deterministic abstracts of the trident stand-in (one english and one german abstract, none for some ids).
+    The topic of an abstract is the number of the id modulo the number of topics.
+    :param freebase_uri: the uri of the candidate
+    :param names: the entity names that are used in the abstracts
+    :return: list of strings
+    """
+    seed = stable_hash(freebase_uri)
+    if seed % 5 == 0:
+        return []
+    generator = random.Random(seed)
+    topic = int(freebase_uri.rsplit(".", 1)[-1], 16) % topic_count(names)
+    words = []
+    for _ in range(60):
+        if generator.random() < 0.4:
+            words.append(choose_name(generator, names, topic))
+        else:
+            words.append(generator.choice(COMMON_WORDS))
+    text = sentence_case(" ".join(words))
+    return ['"{}."@en"'.format(text), '"{}."@de"'.format(text[:80])]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Handler of the stand-ins. The latencies and the entity names are attributes of the server.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, response):
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if not url.path.endswith("/_search"):
+            self.send_error(404)
+            return
+        time.sleep(self.server.es_latency)
+        query = parse_qs(url.query).get("q", [""])[0]
+        if not isinstance(query, type(u"")):
+            query = query.decode("utf-8")
+        self.send_json(fake_hits(query, self.server.topics, self.server.topic_count))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.read_body()
+        if url.path.endswith("/_msearch"):
+            time.sleep(self.server.es_latency)
+            lines = [json.loads(line) for line in body.splitlines() if line.strip()]
+            # the lines are pairs of header and search
+            responses = [fake_hits(search["query"]["query_string"]["query"], self.server.topics,
+                                   self.server.topic_count) for search in lines[1::2]]
+            self.send_json({"responses": responses})
+        elif url.path.endswith("/sparql"):
+            time.sleep(self.server.trident_latency)
+            query = parse_qs(body).get("query", [""])[0]
+            batch = "VALUES" in query
+            bindings = []
+            for freebase_uri in re.findall(r"<(http://rdf\.freebase\.com/ns/[^>]+)>", query):
+                for abstract in fake_abstracts(freebase_uri, self.server.names):
+                    binding = {"abstract": {"type": "literal", "value": abstract}}
+                    if batch:
+                        binding["freebase"] = {"type": "uri", "value": freebase_uri}
+                    bindings.append(binding)
+            self.send_json({"results": {"bindings": bindings}})
+        else:
+            self.send_error(404)
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, es_latency=0.0, trident_latency=0.0, entities=2000, seed=0, port=0):
+        """
+        :param es_latency: the latency of each elastic search request (seconds)
+        :param trident_latency: the latency of each sparql query (seconds)
+        :param entities: the number of entity names (the same as the generator)
+        :param seed: seed of the entity names (the same as the generator)
+        :param port: the port of the server (0: random free port)
+        """
+        HTTPServer.__init__(self, ("127.0.0.1", port), StubHandler)
+        self.es_latency = es_latency
+        self.trident_latency = trident_latency
+        self.names = entity_names(entities, seed)
+        # {lowercase entity name: topic}
+        self.topic_count = topic_count(self.names)
+        self.topics = dict((name.lower(), index // TOPIC_SIZE % self.topic_count)
+                           for index, name in enumerate(self.names))
+
+    @property
+    def domain(self):
+        return "127.0.0.1:{}".format(self.server_address[1])
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+########################################################
+#                        runner                        #
+########################################################
+class NullOutput(object):
+    """
+    An output file that counts the lines and discards them
+    """
+
+    def __init__(self):
+        self.lines = 0
+
+    def write(self, data):
+        self.lines += data.count("\n")
+
+    def flush(self):
+        pass
+
+
+def run_benchmark(warc_filename, es_latency=0.005, trident_latency=0.05, linking_mode=None):
+    """
+    Runs the linking of linker.main (linker.link_warc) over a warc file against the local stand-ins. The output lines
+    are counted and discarded.
+    :param warc_filename: the path to the warc file
+    :param es_latency: the latency of each elastic search request (seconds)
+    :param trident_latency: the latency of each sparql query (seconds)
+    :param linking_mode: "sequential", "concurrent" or "pipeline" (default: linker.LINKING_MODE)
+    :return: a dictionary with the results
+    """
+    import linker
+    import http_client
+    import metrics
+
+    if linking_mode:
+        linker.LINKING_MODE = linking_mode
+    server = StubServer(es_latency, trident_latency).start()
+    output = NullOutput()
+
+    start = time.time()
+    try:
+        linker.link_warc(server.domain, server.domain, warc_filename, output)
+    finally:
+        server.shutdown()
+    total = time.time() - start
+
+    snapshot = metrics.get_metrics().snapshot()
+    documents = snapshot["counters"].get("preprocessed_documents", 0)
+    mentions = snapshot["counters"].get("mentions", 0)
+    return {
+        "warc_file": warc_filename,
+        "linking_mode": linker.LINKING_MODE,
+        "es_latency": es_latency,
+        "trident_latency": trident_latency,
+        "documents": documents,
+        "mentions": mentions,
+        "output_lines": output.lines,
+        "seconds": total,
+        "documents_per_second": documents / total if total else 0.0,
+        "mentions_per_second": mentions / total if total else 0.0,
+        "stages": dict((stage, values["seconds"]) for stage, values in snapshot["stages"].items()),
+        "requests": http_client.get_client().stats(),
+        "candidate_cache": linker.candidate_cache.stats(),
+        "abstract_store": linker.kb_store.stats(),
+        "metrics": snapshot
+    }
+
+
+def compare(baseline, results):
+    """
+    Prints the ratio of the throughput and of the time of each stage of two benchmark results
+    :param baseline: dictionary (json of a previous run)
+    :param results: dictionary (json of the current run)
+    :return: None
+    """
+    for key in ("documents_per_second", "mentions_per_second"):
+        ratio = results[key] / baseline[key] if baseline[key] else float("inf")
+        print("{}: {:.3f} -> {:.3f} ({:.2f}x)".format(key, baseline[key], results[key], ratio))
+    for stage in sorted(set(baseline["stages"]) | set(results["stages"])):
+        before = baseline["stages"].get(stage, 0.0)
+        after = results["stages"].get(stage, 0.0)
+        print("stage {}: {:.3f}s -> {:.3f}s".format(stage, before, after))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the entity linking pipeline")
+    subparsers = parser.add_subparsers(dest="command")
+
+    generate_parser = subparsers.add_parser("generate", help="generate a synthetic warc file")
+    generate_parser.add_argument("output")
+    generate_parser.add_argument("--documents", type=int, default=100)
+    generate_parser.add_argument("--words", type=int, default=500, help="words of each document")
+    generate_parser.add_argument("--mention-density", type=float, default=0.1)
+    generate_parser.add_argument("--entities", type=int, default=2000, help="number of distinct entity names")
+    generate_parser.add_argument("--seed", type=int, default=0)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmark against local stand-ins of ES and trident")
+    run_parser.add_argument("warc_file")
+    run_parser.add_argument("--es-latency", type=float, default=0.005, help="seconds")
+    run_parser.add_argument("--trident-latency", type=float, default=0.05, help="seconds")
+    run_parser.add_argument("--output", default=None, help="json file of the results")
+    run_parser.add_argument("--linking-mode", default=None, choices=["sequential", "concurrent", "pipeline"],
+                            help="default: LINKING_MODE of linker.py")
+
+    compare_parser = subparsers.add_parser("compare", help="compare two json results")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("results")
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        generate_warc(args.output, args.documents, args.words, args.mention_density, args.entities, args.seed)
+    elif args.command == "run":
+        results = run_benchmark(args.warc_file, args.es_latency, args.trident_latency, args.linking_mode)
+        print(json.dumps(results, indent=2, sort_keys=True))
+        if args.output:
+            with open(args.output, "w") as output_file:
+                json.dump(results, output_file, indent=2, sort_keys=True)
+    elif args.command == "compare":
+        with open(args.baseline) as baseline_file, open(args.results) as results_file:
+            compare(json.load(baseline_file), json.load(results_file))
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+This module implements a cache for the candidates retrieved from elastic search.
+The cache has two tiers: a bounded in-memory LRU tier and an optional on-disk tier (sqlite file) that survives
+across runs.
+"""
+
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# number of writes after which the on-disk tier is committed
+COMMIT_EVERY = 100
+
+
+def normalize_mention(mention):
+    """
+    Normalizes the text of a mention in order to be used as a key in the cache
+    (e.g. "  United   States " -> "united states")
+    :param mention: string
+    :return: string
+    """
+    return " ".join(mention.lower().split())
+
+
+class CandidateCache(object):
+    """
+    Mention -> candidates cache. The values must be json serializable in order to be stored on disk.
+    """
+
+    def __init__(self, max_size=100000, filename=None, table="candidates"):
+        """
+        :param max_size: the maximum number of mentions kept in memory
+        :param filename: the path to the sqlite file of the on-disk tier. If None the cache is kept only in memory
+        :param table: the name of the table in the sqlite file
+        """
+        self.max_size = max_size
+        self.filename = filename
+        self.table = table
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.pending_writes = 0
+        self.connection = None
+        if filename:
+            self.connection = sqlite3.connect(filename, check_same_thread=False)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS {} (mention TEXT PRIMARY KEY, value TEXT)"
+                                    .format(table))
+            self.connection.commit()
+
+    def __len__(self):
+        return len(self.memory)
+
+    def _remember(self, key, value):
+        """
+        Adds a value in the memory tier and evicts the least recently used entry if the cache is full
+        """
+        self.memory[key] = value
+        if len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def get(self, mention):
+        """
+        Finds the cached value of a mention
+        :param mention: string (e.g. "Vrije University")
+        :return: the cached value or None if the mention is not cached
+        """
+        key = normalize_mention(mention)
+        with self.lock:
+            if key in self.memory:
+                # move the entry at the end (most recently used)
+                value = self.memory.pop(key)
+                self.memory[key] = value
+                self.hits += 1
+                return value
+
+            if self.connection is not None:
+                row = self.connection.execute("SELECT value FROM {} WHERE mention = ?".format(self.table),
+                                              (key,)).fetchone()
+                if row is not None:
+                    # the candidates keep the order of the elastic search score
+                    value = json.loads(row[0], object_pairs_hook=OrderedDict)
+                    self._remember(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def put(self, mention, value):
+        """
+        Stores the value of a mention in both tiers
+        :param mention: string (e.g. "Vrije University")
+        :param value: json serializable value
+        :return: None
+        """
+        key = normalize_mention(mention)
+        with self.lock:
+            self._remember(key, value)
+            if self.connection is not None:
+                self.connection.execute("INSERT OR REPLACE INTO {} (mention, value) VALUES (?, ?)".format(self.table),
+                                        (key, json.dumps(value)))
+                self.pending_writes += 1
+                if self.pending_writes >= COMMIT_EVERY:
+                    self.connection.commit()
+                    self.pending_writes = 0
+
+    def stats(self):
+        """
+        :return: a dictionary with the hit/miss counters of the cache
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": float(self.hits) / lookups if lookups else 0.0,
+            "size": len(self.memory)
+        }
+
+    def close(self):
+        """
+        Commits the pending writes and closes the on-disk tier
+        :return: None
+        """
+        with self.lock:
+            if self.connection is not None:
+                self.connection.commit()
+                self.connection.close()
+                self.connection = None
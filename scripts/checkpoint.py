@@ -0,0 +1,105 @@
+"""
+This module implements the checkpoint of a linker run that writes its output to a file.
+The checkpoint keeps the WARC-TREC-ID and the (decompressed) end offset of the last document whose output lines are
+written to the output file, and the size of the output file at that point. A new run with the same output file
+truncates the output to that size and continues from the offset, so the documents before it are not read again.
+"""
+
+import json
+import os
+
+
+class Checkpoint(object):
+    """
+    The state of a run, kept in a json file next to the output file
+    """
+
+    def __init__(self, filename, warc_filename):
+        """
+        :param filename: the path to the checkpoint file
+        :param warc_filename: the path to the warc file of the run
+        """
+        self.filename = filename
+        self.warc_filename = os.path.abspath(warc_filename)
+        self.warc_size = os.path.getsize(warc_filename)
+        self.warc_id = None
+        self.offset = 0
+        self.output_size = 0
+        self.documents = 0
+        self.completed = False
+
+    def load(self):
+        """
+        Loads the state of a previous run. A checkpoint of a different warc file is ignored.
+        :return: True if the state of a previous run was loaded
+        """
+        if not os.path.exists(self.filename):
+            return False
+        with open(self.filename) as checkpoint_file:
+            state = json.load(checkpoint_file)
+        if state["warc_file"] != self.warc_filename or state["warc_size"] != self.warc_size:
+            return False
+
+        self.warc_id = state["warc_id"]
+        self.offset = state["offset"]
+        self.output_size = state["output_size"]
+        self.documents = state["documents"]
+        self.completed = state["completed"]
+        return True
+
+    def save(self):
+        """
+        Writes the state to the checkpoint file. The file is replaced at once, so a run that is killed while
+        saving leaves the previous checkpoint.
+        :return: None
+        """
+        state = {
+            "warc_file": self.warc_filename,
+            "warc_size": self.warc_size,
+            "warc_id": self.warc_id,
+            "offset": self.offset,
+            "output_size": self.output_size,
+            "documents": self.documents,
+            "completed": self.completed
+        }
+        temporary_filename = "{}.tmp".format(self.filename)
+        with open(temporary_filename, "w") as checkpoint_file:
+            json.dump(state, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.rename(temporary_filename, self.filename)
+
+    def open_output(self, output_filename):
+        """
+        Opens the output file for appending. The lines written after the checkpoint (by a run that was killed) are
+        removed, so each document is written once.
+        :param output_filename: the path to the output file
+        :return: file object
+        """
+        output = open(output_filename, "a")
+        output.truncate(self.output_size)
+        return output
+
+    def commit(self, output, warc_id, offset):
+        """
+        Flushes the output file to disk and records the document as processed
+        :param output: the output file (as returned from open_output)
+        :param warc_id: the WARC-TREC-ID of the last document that is written to the output
+        :param offset: the end offset of the record of the document
+        :return: None
+        """
+        output.flush()
+        os.fsync(output.fileno())
+        self.warc_id = warc_id
+        self.offset = offset
+        self.output_size = os.fstat(output.fileno()).st_size
+        self.documents += 1
+        self.save()
+
+    def finish(self):
+        """
+        Records that all the documents of the warc file are processed
+        :return: None
+        """
+        self.completed = True
+        self.save()
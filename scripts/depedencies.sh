@@ -5,6 +5,7 @@ pip install --user lxml
 pip install --user --upgrade setuptools
 pip install --user nltk
 pip install --user textdistance
+pip install --user numpy
 
 
 #----------SPACY-------------
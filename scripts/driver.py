@@ -0,0 +1,180 @@
+"""
+Sharded linking driver.
+The input warc file is split into N record-aligned shards (gzipped warc files, one gzip member per record), one
+linker.py worker is started for each shard (local processes, or processes on other nodes through a launcher command
+such as prun) and the output of the workers is merged in WARC-TREC-ID order.
+
+Each worker writes its output with a checkpoint (see checkpoint.py) into the folder of its shard, so running the same
+command again continues the unfinished shards. The shards are reused if they already exist. The workers run in the
+folder of the driver, so the relative files of linker.py (e.g. LABEL_INDEX_FILE, KB_PROFILE_FILE) are the same files as
+in a run of linker.py, and their logs are appended to the same log files.
+
+Usage:
+    python driver.py ES_DOMAIN[,ES_DOMAIN...] SQL_DOMAIN[,SQL_DOMAIN...] WARC_FILE OUTPUT_FILE [--shards 4]
+        [--work-dir shards] [--launcher "prun -t 21600 -v -np 1"]
+"""
+
+import argparse
+import json
+import logging
+import os
+import shlex
+import subprocess
+import sys
+
+import warc_reader
+import warc_index
+
+# the linker script of the workers
+LINKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "linker.py")
+# file in the work folder that lists the shards (it is written after all the shards are written)
+SHARDS_MANIFEST = "shards.json"
+
+#  define logger as global variable
+logger = logging.getLogger(__name__)
+
+
+########################################################
+#                    split the warc file               #
+########################################################
+def split_warc(warc_filename, shards, work_dir):
+    """
+    Splits a warc file into shards. The records are assigned to the shards in turn (round robin), so the shards have
+    almost the same number of documents.
+    :param warc_filename: the path to the warc file
+    :param shards: the number of shards
+    :param work_dir: the folder of the shards
+    :return: a list with the paths of the shards
+    """
+    manifest_filename = os.path.join(work_dir, SHARDS_MANIFEST)
+    if os.path.exists(manifest_filename):
+        with open(manifest_filename) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest["warc_file"] == os.path.abspath(warc_filename) and len(manifest["shards"]) == shards:
+            logger.info("Using the existing shards of {}".format(warc_filename))
+            return manifest["shards"]
+
+    shard_filenames = []
+    for shard in range(shards):
+        shard_dir = os.path.join(work_dir, "shard-{:03d}".format(shard))
+        if not os.path.isdir(shard_dir):
+            os.makedirs(shard_dir)
+        shard_filenames.append(os.path.abspath(os.path.join(shard_dir, "input.warc.gz")))
+
+    shard_files = [open(shard_filename, "wb") for shard_filename in shard_filenames]
+    try:
+        documents = 0
+        for record in warc_reader.read_records(warc_filename):
+            if record.warc_id is None:
+                # records without WARC-TREC-ID (e.g. warcinfo) are skipped by the linker
+                continue
+            shard_files[documents % shards].write(warc_index.gzip_member(record.to_bytes()))
+            documents += 1
+    finally:
+        for shard_file in shard_files:
+            shard_file.close()
+    logger.info("Split {} documents of {} into {} shards".format(documents, warc_filename, shards))
+
+    with open(manifest_filename, "w") as manifest_file:
+        json.dump({"warc_file": os.path.abspath(warc_filename), "shards": shard_filenames}, manifest_file)
+    return shard_filenames
+
+
+########################################################
+#                      run the workers                 #
+########################################################
+def worker_command(launcher, es_domain, sql_domain, shard_filename, output_filename):
+    """
+    Builds the command of one linker worker
+    :param launcher: command that starts a process on another node (e.g. "prun -t 21600 -v -np 1"), or None for a
+     local process
+    :param es_domain: ELS_NODE:ELS_PORT
+    :param sql_domain: SQL_NODE:SQL_PORT
+    :param shard_filename: the path to the warc file of the shard
+    :param output_filename: the path to the output file of the shard
+    :return: list of strings
+    """
+    prefix = shlex.split(launcher) if launcher else []
+    return prefix + [sys.executable, LINKER_SCRIPT, es_domain, sql_domain, shard_filename, output_filename]
+
+
+def run_workers(shard_filenames, es_domains, sql_domains, launcher=None):
+    """
+    Runs one linker worker for each shard and waits for all of them. The workers use the elastic search and trident
+    domains in turn. Each worker runs in the current folder and writes its output into the folder of its shard.
+    :param shard_filenames: the paths of the shards
+    :param es_domains: list with ELS_NODE:ELS_PORT
+    :param sql_domains: list with SQL_NODE:SQL_PORT
+    :param launcher: command that starts a process on another node, or None for local processes
+    :return: a list with the paths of the output files of the shards
+    """
+    processes = []
+    output_filenames = []
+    for shard, shard_filename in enumerate(shard_filenames):
+        shard_dir = os.path.dirname(shard_filename)
+        output_filename = os.path.join(shard_dir, "output.tsv")
+        command = worker_command(launcher, es_domains[shard % len(es_domains)], sql_domains[shard % len(sql_domains)],
+                                 shard_filename, output_filename)
+        logger.info("Starting worker {}: {}".format(shard, " ".join(command)))
+        processes.append(subprocess.Popen(command))
+        output_filenames.append(output_filename)
+
+    failed = []
+    for shard, process in enumerate(processes):
+        if process.wait() != 0:
+            failed.append(shard)
+    if failed:
+        raise RuntimeError("The workers of the shards {} failed. Run the same command again in order to continue "
+                           "them.".format(failed))
+    return output_filenames
+
+
+########################################################
+#                   merge the output                   #
+########################################################
+def merge_outputs(output_filenames, merged_filename):
+    """
+    Merges the output files of the shards. The lines are sorted by WARC-TREC-ID and the lines of the same document
+    keep the order of the worker, so the merged output does not depend on the number of shards.
+    :param output_filenames: the paths of the output files of the shards
+    :param merged_filename: the path of the merged output file
+    :return: the number of lines
+    """
+    lines = []
+    for output_filename in output_filenames:
+        with open(output_filename) as output_file:
+            lines.extend(output_file.readlines())
+    # sorted is stable
+    lines = sorted(lines, key=lambda line: line.split("\t", 1)[0])
+    with open(merged_filename, "w") as merged_file:
+        merged_file.writelines(lines)
+    return len(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded entity linking of a warc file")
+    parser.add_argument("es_domains", help="ELS_NODE:ELS_PORT (comma separated list for many nodes)")
+    parser.add_argument("sql_domains", help="SQL_NODE:SQL_PORT (comma separated list for many nodes)")
+    parser.add_argument("warc_file")
+    parser.add_argument("output_file")
+    parser.add_argument("--shards", type=int, default=4, help="number of shards (and of linker workers)")
+    parser.add_argument("--work-dir", default=None, help="folder of the shards (default: OUTPUT_FILE.shards)")
+    parser.add_argument("--launcher", default=None,
+                        help='command that starts each worker on a node (e.g. "prun -t 21600 -v -np 1")')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    work_dir = args.work_dir or "{}.shards".format(args.output_file)
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+
+    shard_filenames = split_warc(args.warc_file, args.shards, work_dir)
+    output_filenames = run_workers(shard_filenames, args.es_domains.split(","), args.sql_domains.split(","),
+                                   args.launcher)
+    lines = merge_outputs(output_filenames, args.output_file)
+    logger.info("Merged {} lines of {} shards into {}".format(lines, len(output_filenames), args.output_file))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,18 @@
-import time
+import json
+from collections import OrderedDict
 import requests
 
+import http_client
+
+# maximum number of mentions that are sent to elastic search in one _msearch request
+MSEARCH_BATCH_SIZE = 100
+# status codes (besides 5xx) of failed requests that can succeed when they are sent again (timeout, too many requests)
+TRANSIENT_STATUS = (408, 429)
+
 
 def search(domain, query, size=20):
     url = 'http://%s/freebase/label/_search' % domain
-    response = requests.get(url, params={'q': query, 'size': size})
+    response = http_client.get_client().get(url, endpoint='elasticsearch/_search', params={'q': query, 'size': size})
     id_labels = {}
     if response:
         response = response.json()
@@ -21,44 +29,129 @@ def get_best_candidates(domain, query, results_No=10):
     :param domain:
     :param query:
     :param size:
-    :return:
+    :return: a dictionary {freebase_id: set(labels)} (empty if the query fails every time, e.g. it cannot be parsed)
+     or None if the request failed and can succeed when it is sent again
     """
     url = 'http://%s/freebase/label/_search' % domain
 
-    retries = 3
+    try:
+        # fetch 100 results from freebase
+        response = http_client.get_client().get(url, endpoint='elasticsearch/_search',
+                                                params={'q': query, 'size': 100})
+    except requests.RequestException:
+        # connection error after all the retries
+        return None
+
+    if not response:
+        # the status of the last attempt is not OK
+        if is_transient_status(response.status_code):
+            return None
+        # e.g. 400 for a query that cannot be parsed, no candidates
+        return OrderedDict()
+    response = response.json()
+    return select_best_candidates(response.get('hits', {}).get('hits', []), results_No)
 
-    while retries > 0:
-        retries = retries - 1
-        try:
-            # fetch 100 results from freebase
-            response = requests.get(url, params={'q': query, 'size': 100})
-            break
-        except:
-            # in case of connection error wait 2 second and retry
-            time.sleep(2)
 
-    best_id_labels = {}
+def select_best_candidates(hits, results_No=10):
+    """
+    Keeps the best candidates of the hits of elastic search according to the freebase _score
+    :param hits: the hits of the response of elastic search
+    :param results_No: the number of the hits that are kept
+    :return: an ordered dictionary {freebase_id: set(labels)}, the best score first
+    """
+    best_id_labels = OrderedDict()
     id_labels = []
-    if response:
-        response = response.json()
-        for hit in response.get('hits', {}).get('hits', []):
-            freebase_label = hit.get('_source', {}).get('label')
-            freebase_id = hit.get('_source', {}).get('resource')
-            score = hit.get('_score')
-            id_labels.append([freebase_id, score, freebase_label])
-
-        # find the top 10 according to the score
-        id_labels = sorted(id_labels, key=lambda x: x[1], reverse=True)       # sort entries in list according to 2nd value (score)
-        for i in range(results_No):
-            try:
-                best_id_labels.setdefault(id_labels[i][0], set()).add(id_labels[i][2])
-            except:
-                # candidates found less than results_No
-                break
+    for hit in hits:
+        freebase_label = hit.get('_source', {}).get('label')
+        freebase_id = hit.get('_source', {}).get('resource')
+        score = hit.get('_score')
+        id_labels.append([freebase_id, score, freebase_label])
+
+    # find the top 10 according to the score
+    # sort entries in list according to 2nd value (score)
+    id_labels = sorted(id_labels, key=lambda x: x[1], reverse=True)
+    for i in range(results_No):
+        try:
+            best_id_labels.setdefault(id_labels[i][0], set()).add(id_labels[i][2])
+        except:
+            # candidates found less than results_No
+            break
 
     return best_id_labels
 
 
+def get_best_candidates_batch(domain, queries, results_No=10, batch_size=MSEARCH_BATCH_SIZE):
+    """
+    Finds the best candidates of many queries (e.g. all the mentions of a document) by using the _msearch endpoint
+    of elastic search. One request is sent for every batch_size queries.
+    :param domain:
+    :param queries: a list with strings
+    :param results_No: the number of the candidates of each query
+    :param batch_size: the maximum number of queries in one request
+    :return: a list with the best candidates of each query, in the order of the queries ({freebase_id: set(labels)},
+     empty if the query fails every time, or None if the query failed and can succeed when it is sent again)
+    """
+    url = 'http://%s/freebase/label/_msearch' % domain
+
+    best_candidates = []
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size]
+        # the body has two lines for each query (header and search), as defined by _msearch
+        lines = []
+        for query in batch:
+            lines.append(json.dumps({}))
+            lines.append(json.dumps({'query': {'query_string': {'query': query}}, 'size': 100}))
+        body = "\n".join(lines) + "\n"
+
+        try:
+            # fetch 100 results from freebase for each query
+            response = http_client.get_client().post(url, endpoint='elasticsearch/_msearch', data=body)
+        except requests.RequestException:
+            # connection error after all the retries
+            response = None
+
+        responses = []
+        if response:
+            responses = response.json().get('responses', [])
+        for i in range(len(batch)):
+            if i >= len(responses):
+                # the request failed
+                best_candidates.append(None)
+            elif 'error' in responses[i]:
+                # the query has an error instead of hits
+                if is_query_error(responses[i]['error'], responses[i].get('status')):
+                    best_candidates.append(OrderedDict())
+                else:
+                    best_candidates.append(None)
+            else:
+                best_candidates.append(select_best_candidates(responses[i].get('hits', {}).get('hits', []),
+                                                              results_No))
+
+    return best_candidates
+
+
+def is_transient_status(status):
+    """
+    :param status: the status code of a failed request
+    :return: True if the request can succeed when it is sent again (timeout, too many requests or server error)
+    """
+    return status >= 500 or status in TRANSIENT_STATUS
+
+
+def is_query_error(error, status=None):
+    """
+    Finds if the error of a query of _msearch is caused by the query itself (e.g. the query string cannot be parsed),
+    so the query fails every time it is sent
+    :param error: the error of the query (an object with the type of the exception, or a string in old versions)
+    :param status: the status code of the query (None if the response does not have one)
+    :return: boolean
+    """
+    if status is not None and not is_transient_status(status):
+        return True
+    # e.g. "parse_exception", "query_shard_exception" with a "Failed to parse query" reason, "QueryParsingException"
+    return "pars" in json.dumps(error).lower()
+
+
 if __name__ == '__main__':
     import sys
     try:
@@ -0,0 +1,171 @@
+"""
+This module extracts the text of the html body of a warc record.
+The http headers are parsed separately and only the body of the response is parsed by the lxml (libxml2) html
+parser. The text is collected while parsing, so no tree is built, and the script, style and comment nodes are dropped.
+"""
+
+import codecs
+import re
+
+from lxml import etree
+
+# content types whose text is extracted by the html parser
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+# content types whose body is already text
+TEXT_CONTENT_TYPES = ("text/plain",)
+
+# tags whose text is dropped
+SKIP_TAGS = frozenset(["script", "style", "noscript", "template"])
+
+# charset used when the charset of the document is not defined or is unknown
+DEFAULT_CHARSET = "utf-8"
+# codecs that are text encodings for python but not charsets of a document (they fail or decode escape sequences)
+NON_DOCUMENT_CODECS = frozenset(["undefined", "unicode-escape", "raw-unicode-escape", "string-escape",
+                                 "unicode-internal", "idna", "punycode"])
+
+# <meta charset="..."> or <meta http-equiv="Content-Type" content="text/html; charset=...">
+META_CHARSET = re.compile(br'<meta[^>]+charset\s*=\s*["\']?\s*([-\w.:]+)', re.IGNORECASE)
+
+
+class TextCollector(object):
+    """
+    Target of the lxml parser. It keeps the text of the document except the text of SKIP_TAGS and the comments.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.skip = 0
+
+    def start(self, tag, attrib):
+        if tag in SKIP_TAGS:
+            self.skip += 1
+
+    def end(self, tag):
+        if tag in SKIP_TAGS and self.skip > 0:
+            self.skip -= 1
+
+    def data(self, data):
+        if not self.skip:
+            self.parts.append(data)
+
+    def comment(self, text):
+        # comments are dropped
+        pass
+
+    def close(self):
+        return u"".join(self.parts)
+
+
+def split_http_response(body):
+    """
+    Splits the body of a warc response record into the http headers and the content
+    :param body: the body of the warc record (bytes)
+    :return: status line, a dictionary with the http headers {lowercase name: value}, content (bytes)
+     If the body is not an http response the status line is None, the headers are empty and the content is the body
+    """
+    if not body.startswith(b"HTTP/"):
+        return None, {}, body
+
+    # the headers end at the first empty line
+    match = re.search(br"\r?\n\r?\n", body)
+    if match is None:
+        raw_headers, content = body, b""
+    else:
+        raw_headers, content = body[:match.start()], body[match.end():]
+
+    lines = raw_headers.splitlines()
+    headers = {}
+    for line in lines[1:]:
+        if b":" in line:
+            name, value = line.split(b":", 1)
+            headers[name.strip().lower().decode("latin-1")] = value.strip().decode("latin-1")
+
+    return lines[0].decode("latin-1"), headers, content
+
+
+def parse_content_type(value):
+    """
+    Parses the value of a Content-Type header
+    :param value: string (e.g. "text/html; charset=UTF-8")
+    :return: a tuple (mime type, charset). charset is None if it is not defined
+    """
+    parts = value.split(";")
+    mime_type = parts[0].strip().lower()
+    charset = None
+    for parameter in parts[1:]:
+        if "=" in parameter:
+            name, parameter_value = parameter.split("=", 1)
+            if name.strip().lower() == "charset":
+                charset = parameter_value.strip().strip("\"'") or None
+    return mime_type, charset
+
+
+def find_charset(content, declared_charset=None):
+    """
+    Finds the charset of a document: the charset of the http headers, otherwise the charset of the <meta> tag,
+    otherwise DEFAULT_CHARSET. Unknown charsets and the codecs that are not text encodings (e.g. base64, zip, rot13)
+    are ignored.
+    :param content: the content of the document (bytes)
+    :param declared_charset: the charset of the http headers
+    :return: string
+    """
+    candidates = [declared_charset]
+    match = META_CHARSET.search(content[:4096])
+    if match:
+        candidates.append(match.group(1).decode("latin-1"))
+
+    for charset in candidates:
+        if not charset:
+            continue
+        try:
+            codec = codecs.lookup(charset)
+        except LookupError:
+            continue
+        if getattr(codec, "_is_text_encoding", True) and codec.name not in NON_DOCUMENT_CODECS:
+            return codec.name
+    return DEFAULT_CHARSET
+
+
+def decode(content, charset=DEFAULT_CHARSET):
+    """
+    Decodes the content of a document. The invalid bytes are replaced and DEFAULT_CHARSET is used if the charset
+    fails.
+    :param content: bytes
+    :param charset: the charset of the document
+    :return: string
+    """
+    try:
+        return content.decode(charset, "replace")
+    except (LookupError, ValueError, TypeError):
+        # UnicodeError is a ValueError
+        return content.decode(DEFAULT_CHARSET, "replace")
+
+
+def html_to_text(content, charset=DEFAULT_CHARSET):
+    """
+    Extracts the text of an html document. The text of script and style elements and the comments are dropped.
+    :param content: the html document (bytes)
+    :param charset: the charset of the document
+    :return: string
+    """
+    parser = etree.HTMLParser(target=TextCollector())
+    parser.feed(decode(content, charset))
+    return parser.close()
+
+
+def extract_text(body):
+    """
+    Extracts the text of the body of a warc response record
+    :param body: the body of the warc record (bytes)
+    :return: string or None if the content type of the record is not html or text
+    """
+    status, headers, content = split_http_response(body)
+    mime_type, declared_charset = parse_content_type(headers.get("content-type", "text/html"))
+
+    if not content.strip():
+        return None
+    if mime_type in HTML_CONTENT_TYPES:
+        return html_to_text(content, find_charset(content, declared_charset))
+    if mime_type in TEXT_CONTENT_TYPES:
+        return decode(content, find_charset(content, declared_charset))
+    return None
@@ -0,0 +1,150 @@
+"""
+This module implements the http client that is shared by elasticsearch.py and sparql.py.
+The client keeps the connections alive (connection pool), uses connect/read timeouts, retries the failed requests with
+exponential backoff and jitter and keeps latency statistics for each endpoint.
+"""
+
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# timeouts in seconds
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 120
+
+# retries of a failed request (connection error, timeout, 5xx status or invalid json)
+MAX_RETRIES = 3
+# the backoff before the n-th retry is a random time in [0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** n)] seconds
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+
+# number of connections that are kept alive for each host
+POOL_SIZE = 32
+
+# status codes of the responses that are retried
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class HttpClient(object):
+    """
+    http client with connection pool, timeouts, retries and latency statistics
+    """
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, max_retries=MAX_RETRIES,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX, pool_size=POOL_SIZE):
+        """
+        :param connect_timeout: seconds to wait for the connection to the server
+        :param read_timeout: seconds to wait for the response of the server
+        :param max_retries: the number of retries of a failed request
+        :param backoff_base: the base of the exponential backoff (seconds)
+        :param backoff_max: the maximum backoff (seconds)
+        :param pool_size: the number of connections that are kept alive for each host
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.latencies = {}
+
+    def backoff(self, attempt):
+        """
+        Sleeps before the retry of a request (exponential backoff with full jitter)
+        :param attempt: the number of the failed attempt (0 for the first request)
+        :return: None
+        """
+        time.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+
+    def record(self, endpoint, seconds, failed=False):
+        """
+        Keeps the latency of a request
+        :param endpoint: the name of the endpoint (e.g. "trident/sparql")
+        :param seconds: the latency of the request
+        :param failed: True if the request failed
+        :return: None
+        """
+        with self.lock:
+            stats = self.latencies.setdefault(endpoint, {"requests": 0, "errors": 0, "total": 0.0, "max": 0.0})
+            stats["requests"] += 1
+            stats["total"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            if failed:
+                stats["errors"] += 1
+
+    def request(self, method, url, endpoint=None, parse_json=False, **kwargs):
+        """
+        Sends a request and retries it in case of failure
+        :param method: "GET" or "POST"
+        :param url: the url of the request
+        :param endpoint: the name of the endpoint for the statistics (default: the url)
+        :param parse_json: if True the json of the response is returned (invalid json is retried)
+        :param kwargs: the arguments of requests (e.g. params, data)
+        :return: the response (or its json). Without parse_json the response of the last attempt is returned if its
+         status is not OK. With parse_json requests.HTTPError is raised instead (the response has no json)
+        """
+        endpoint = endpoint or url
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                if response.status_code in RETRY_STATUS and attempt < self.max_retries:
+                    raise requests.HTTPError("status {}".format(response.status_code), response=response)
+                result = response
+                if parse_json and response:
+                    result = response.json()
+            except (requests.RequestException, ValueError):
+                # ValueError: the json of the response is invalid
+                self.record(endpoint, time.time() - start, failed=True)
+                if attempt >= self.max_retries:
+                    raise
+                self.backoff(attempt)
+                attempt += 1
+                continue
+            self.record(endpoint, time.time() - start, failed=not response)
+            if parse_json and not response:
+                # the last attempt failed (or its status is not retried)
+                raise requests.HTTPError("status {}".format(response.status_code), response=response)
+            return result
+
+    def get(self, url, endpoint=None, **kwargs):
+        return self.request("GET", url, endpoint=endpoint, **kwargs)
+
+    def post(self, url, endpoint=None, **kwargs):
+        return self.request("POST", url, endpoint=endpoint, **kwargs)
+
+    def stats(self):
+        """
+        :return: a dictionary with the statistics of each endpoint (requests, errors, mean and max latency in seconds)
+        """
+        with self.lock:
+            return dict((endpoint, {
+                "requests": stats["requests"],
+                "errors": stats["errors"],
+                "mean": stats["total"] / stats["requests"],
+                "max": stats["max"]
+            }) for endpoint, stats in self.latencies.items())
+
+
+# shared client (created when it is first used)
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Returns the shared http client
+    :return: object of class HttpClient
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+    return _client
@@ -0,0 +1,383 @@
+"""
+This module implements a local store of the english abstracts and the nouns (NNP) of each freebase_id, built once
+from a DBpedia abstract dump and an owl:sameAs mapping. The store is a memory-mapped file with a sorted index of the
+freebase_ids, so the abstracts and the nouns of a candidate are found with one local lookup (no trident query and
+no NLP while linking).
+
+An abstract belongs to a freebase_id as in the trident query of linker.build_kb_query_for_abstracts: the abstract
+of ?o is kept when ?s owl:sameAs <freebase_id> and ?s owl:sameAs ?o. The abstract of ?s itself is kept as well
+(owl:sameAs is reflexive), so a mapping with the lines "<dbpedia resource> owl:sameAs <freebase uri>" is enough.
+The nouns are extracted from the abstracts as in linker.fill_kb_nouns_batch.
+The dumps are joined by sorting their triples on disk (sorted runs of SORT_CHUNK_SIZE records that are merged), so
+neither the sameAs mapping nor the abstracts have to fit in memory.
+
+The escape sequences of the literals of the dump are decoded (as in label_index.py) and the abstracts are stored in the
+form of the english abstracts of trident, so the abstracts and the nouns of a profile are the ones of the trident
+queries. The check command compares the profiles of some freebase_ids with the abstracts and the nouns of trident.
+
+Usage:
+    python kb_profiles.py build ABSTRACTS_DUMP SAMEAS_DUMP PROFILE_FILE
+    python kb_profiles.py get PROFILE_FILE FREEBASE_ID
+    python kb_profiles.py check PROFILE_FILE SQL_DOMAIN FREEBASE_ID [FREEBASE_ID ...]
+"""
+
+import gzip
+import heapq
+import io
+import itertools
+import json
+import mmap
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+
+import label_index
+
+# first bytes of a profile file
+MAGIC = b"KBPROF1\n"
+# the header after MAGIC: number of freebase_ids and offset of the id table
+HEADER = struct.Struct("<IQ")
+# an entry of the id table: offset and length of the freebase_id and of its profile (json [abstracts, nouns])
+ID_ENTRY = struct.Struct("<QIQI")
+
+# a field of a record of a temporary run file of build: the length of the field (utf-8) before the field
+RUN_FIELD = struct.Struct("<I")
+# the position of an abstract in the dump (big-endian, so the bytes sort as the numbers)
+SEQUENCE = struct.Struct(">Q")
+
+# number of abstracts that are passed to preprocessing.extract_nouns_from_texts at once
+NOUN_BATCH_SIZE = 100
+# number of records that are sorted in memory before they are written to a temporary run file (build)
+SORT_CHUNK_SIZE = 1000000
+
+# a line of an n-triples dump (subject, predicate, object)
+TRIPLE_PATTERN = re.compile(r'^<([^>]+)>\s+<([^>]+)>\s+(.*?)\s*\.\s*$')
+SAME_AS = "http://www.w3.org/2002/07/owl#sameAs"
+ABSTRACT = "http://dbpedia.org/ontology/abstract"
+FREEBASE_PREFIX = "http://rdf.freebase.com/ns/"
+# an english literal of the dump ("text"@en)
+ENGLISH_LITERAL_PATTERN = re.compile(r'^"(.*)"@en$')
+# an english abstract as returned from trident (see linker.get_only_english_abstract_from_json)
+TRIDENT_ABSTRACT = u'"{}"@en"'
+
+# the shared profile store of each file
+_stores = {}
+
+
+def read_triples(dump_filename, predicate):
+    """
+    Reads the triples of a predicate from an n-triples dump
+    :param dump_filename: the path to the dump (optionally gzipped)
+    :param predicate: the uri of the predicate
+    :return: generator of tuples (subject, object). The object is a uri (without <>) or a literal (as in the dump)
+    """
+    opener = gzip.open if dump_filename.endswith(".gz") else io.open
+    with opener(dump_filename, "rb") as dump:
+        for line in dump:
+            match = TRIPLE_PATTERN.match(line.decode("utf-8", "replace"))
+            if match is None or match.group(2) != predicate:
+                continue
+            subject, value = match.group(1), match.group(3)
+            if value.startswith("<") and value.endswith(">"):
+                value = value[1:-1]
+            yield subject, value
+
+
+def english_abstracts(abstracts_filename):
+    """
+    Reads the english abstracts of a DBpedia abstract dump
+    :param abstracts_filename: the path to the dump (n-triples)
+    :return: generator of tuples (resource, abstract). The escapes of the abstract are decoded and the abstract is in
+     the form of TRIDENT_ABSTRACT
+    """
+    for resource, value in read_triples(abstracts_filename, ABSTRACT):
+        match = ENGLISH_LITERAL_PATTERN.match(value)
+        if match is not None:
+            text = label_index.ESCAPE_PATTERN.sub(label_index.unescape, match.group(1))
+            yield resource, TRIDENT_ABSTRACT.format(text)
+
+
+def write_run(records, directory):
+    """
+    Sorts a chunk of records and writes it to a temporary run file
+    :param records: a list with tuples of bytes
+    :param directory: the folder of the temporary file
+    :return: the run file, at its beginning
+    """
+    records.sort()
+    run = tempfile.TemporaryFile(dir=directory)
+    for record in records:
+        for field in record:
+            run.write(RUN_FIELD.pack(len(field)))
+            run.write(field)
+    run.seek(0)
+    return run
+
+
+def read_run(run, fields):
+    """
+    :param run: a run file as returned from write_run
+    :param fields: the number of fields of each record
+    :return: generator of tuples of bytes, sorted
+    """
+    while True:
+        record = []
+        for _ in range(fields):
+            data = run.read(RUN_FIELD.size)
+            if not data:
+                return
+            record.append(run.read(RUN_FIELD.unpack(data)[0]))
+        yield tuple(record)
+
+
+def sort_records(records, fields, directory):
+    """
+    Sorts records that may not fit in memory: chunks of SORT_CHUNK_SIZE records are sorted and written to temporary
+    run files that are merged
+    :param records: iterable with tuples of bytes
+    :param fields: the number of fields of each record
+    :param directory: the folder of the temporary files
+    :return: generator of the records, sorted
+    """
+    runs = []
+    try:
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= SORT_CHUNK_SIZE:
+                runs.append(write_run(chunk, directory))
+                chunk = []
+        # the last chunk is merged from memory
+        chunk.sort()
+        for record in heapq.merge(chunk, *[read_run(run, fields) for run in runs]):
+            yield record
+    finally:
+        for run in runs:
+            run.close()
+
+
+def freebase_ids_by_resource(sameas_filename, directory):
+    """
+    Reads the sameAs mapping
+    :param sameas_filename: the path to the sameAs dump
+    :param directory: the folder of the temporary files
+    :return: generator of tuples (resource, freebase_id) (utf-8) with the resources whose abstracts belong to each
+     freebase_id, sorted by resource
+    """
+    same_as = sort_records(((subject.encode("utf-8"), value.encode("utf-8"))
+                            for subject, value in read_triples(sameas_filename, SAME_AS)), 2, directory)
+    prefix = FREEBASE_PREFIX.encode("utf-8")
+
+    def resource_ids():
+        for subject, triples in itertools.groupby(same_as, key=lambda triple: triple[0]):
+            values = set(value for _, value in triples)
+            # m.0abc -> /m/0abc (the freebase_id of elastic search)
+            subject_ids = set(b"/" + value[len(prefix):].replace(b".", b"/", 1) for value in values
+                              if value.startswith(prefix))
+            for resource in values | set([subject]):
+                for freebase_id in subject_ids:
+                    yield resource, freebase_id
+
+    return sort_records(resource_ids(), 2, directory)
+
+
+def abstracts_by_freebase_id(abstracts_filename, sameas_filename, directory):
+    """
+    Joins the english abstracts with the sameAs mapping
+    :param abstracts_filename: the path to the DBpedia abstract dump (n-triples)
+    :param sameas_filename: the path to the sameAs dump (n-triples)
+    :param directory: the folder of the temporary files
+    :return: generator of tuples (freebase_id, abstracts) (unicode), sorted by freebase_id as utf-8 bytes. The
+     abstracts of each freebase_id are in the order of the dump, without duplicates
+    """
+    # only the english abstracts, with their position in the dump
+    abstracts = sort_records(((resource.encode("utf-8"), SEQUENCE.pack(sequence), value.encode("utf-8"))
+                              for sequence, (resource, value) in enumerate(english_abstracts(abstracts_filename))),
+                             3, directory)
+    resource_ids = freebase_ids_by_resource(sameas_filename, directory)
+
+    def joined():
+        # merge join of the two sorted streams on the resource
+        id_groups = itertools.groupby(resource_ids, key=lambda pair: pair[0])
+        abstract_groups = itertools.groupby(abstracts, key=lambda record: record[0])
+        id_group = next(id_groups, None)
+        abstract_group = next(abstract_groups, None)
+        while id_group is not None and abstract_group is not None:
+            if id_group[0] < abstract_group[0]:
+                id_group = next(id_groups, None)
+            elif id_group[0] > abstract_group[0]:
+                abstract_group = next(abstract_groups, None)
+            else:
+                freebase_ids = set(freebase_id for _, freebase_id in id_group[1])
+                for _, sequence, value in abstract_group[1]:
+                    for freebase_id in freebase_ids:
+                        yield freebase_id, sequence, value
+                id_group = next(id_groups, None)
+                abstract_group = next(abstract_groups, None)
+
+    for freebase_id, records in itertools.groupby(sort_records(joined(), 3, directory), key=lambda record: record[0]):
+        values = []
+        for _, _, value in records:
+            value = value.decode("utf-8")
+            if value not in values:
+                values.append(value)
+        yield freebase_id.decode("utf-8"), values
+
+
+def build(abstracts_filename, sameas_filename, profile_filename):
+    """
+    Builds the profile file
+    :param abstracts_filename: the path to the DBpedia abstract dump (n-triples)
+    :param sameas_filename: the path to the sameAs dump (n-triples)
+    :param profile_filename: the path to the profile file
+    :return: the number of freebase_ids
+    """
+    import preprocessing
+
+    directory = os.path.dirname(os.path.abspath(profile_filename))
+    id_entries = tempfile.TemporaryFile(dir=directory)
+    try:
+        with open(profile_filename, "wb") as profile_file:
+            profile_file.write(MAGIC)
+            profile_file.write(b"\0" * HEADER.size)
+
+            ids = 0
+            profiles = abstracts_by_freebase_id(abstracts_filename, sameas_filename, directory)
+            while True:
+                batch = list(itertools.islice(profiles, NOUN_BATCH_SIZE))
+                if not batch:
+                    break
+                # the english abstracts of each candidate are concatenated, as in linker.fill_kb_nouns_batch
+                all_nouns = preprocessing.extract_nouns_from_texts([" ".join(abstracts) for _, abstracts in batch])
+                for (freebase_id, abstracts), nouns in zip(batch, all_nouns):
+                    key = freebase_id.encode("utf-8")
+                    profile = json.dumps([abstracts, list(nouns)]).encode("utf-8")
+                    id_entries.write(ID_ENTRY.pack(profile_file.tell(), len(key), profile_file.tell() + len(key),
+                                                   len(profile)))
+                    profile_file.write(key)
+                    profile_file.write(profile)
+                    ids += 1
+
+            # the ids are sorted as utf-8 bytes, the order of the binary search
+            id_table = profile_file.tell()
+            id_entries.seek(0)
+            shutil.copyfileobj(id_entries, profile_file)
+            profile_file.seek(len(MAGIC))
+            profile_file.write(HEADER.pack(ids, id_table))
+    finally:
+        id_entries.close()
+    return ids
+
+
+class ProfileStore(object):
+    """
+    A memory-mapped profile file: freebase_id -> (english abstracts, kb_nouns)
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: the path to the profile file (as written by build)
+        """
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+        self.file = open(filename, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError("{} is not a profile file".format(filename))
+        self.ids, self.id_table = HEADER.unpack_from(self.data, len(MAGIC))
+
+    def get(self, freebase_id):
+        """
+        Finds the profile of a candidate (binary search)
+        :param freebase_id: the freebase_id of a candidate as returned from elastic search
+        :return: a tuple (abstracts, nouns) or None if the freebase_id does not have an english abstract
+        """
+        key = freebase_id.encode("utf-8")
+        low, high = 0, self.ids
+        while low < high:
+            middle = (low + high) // 2
+            key_offset, key_length, offset, length = ID_ENTRY.unpack_from(self.data,
+                                                                          self.id_table + middle * ID_ENTRY.size)
+            current = self.data[key_offset:key_offset + key_length]
+            if current == key:
+                self.hits += 1
+                abstracts, nouns = json.loads(self.data[offset:offset + length].decode("utf-8"))
+                return abstracts, nouns
+            if current < key:
+                low = middle + 1
+            else:
+                high = middle
+        self.misses += 1
+        return None
+
+    def stats(self):
+        """
+        :return: a dictionary with the hit/miss counters of the store
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+def get_profile_store(filename):
+    """
+    Returns the shared profile store of a file (it is memory-mapped once)
+    :param filename: the path to the profile file
+    :return: object of class ProfileStore
+    """
+    if filename not in _stores:
+        _stores[filename] = ProfileStore(filename)
+    return _stores[filename]
+
+
+def check(profile_filename, sql_domain, freebase_ids):
+    """
+    Compares the profiles of some freebase_ids with the english abstracts of trident and their nouns (as in
+    linker.fill_kb_abstracts and linker.fill_kb_nouns_batch)
+    :param profile_filename: the path to the profile file
+    :param sql_domain: SQL_NODE:SQL_PORT
+    :param freebase_ids: a list with the freebase_ids
+    :return: a list with the freebase_ids whose profile differs
+    """
+    import linker
+    import preprocessing
+
+    store = get_profile_store(profile_filename)
+    trident_responses = linker.get_kb_info_by_candidates(sql_domain, freebase_ids)
+    trident_abstracts = [linker.get_only_english_abstract_from_json(trident_responses[freebase_id])
+                         for freebase_id in freebase_ids]
+    trident_nouns = preprocessing.extract_nouns_from_texts([" ".join(abstracts) for abstracts in trident_abstracts])
+    differences = []
+    for freebase_id, abstracts, nouns in zip(freebase_ids, trident_abstracts, trident_nouns):
+        profile = store.get(freebase_id) or ([], [])
+        if list(profile[0]) != abstracts or list(profile[1]) != list(nouns):
+            differences.append(freebase_id)
+    return differences
+
+
+def main():
+    if len(sys.argv) < 4 or sys.argv[1] not in ("build", "get", "check") or \
+            (sys.argv[1] in ("build", "check") and len(sys.argv) < 5):
+        print(__doc__)
+        sys.exit(1)
+
+    if sys.argv[1] == "build":
+        print("Stored the profiles of {} freebase ids".format(build(sys.argv[2], sys.argv[3], sys.argv[4])))
+    elif sys.argv[1] == "check":
+        differences = check(sys.argv[2], sys.argv[3], sys.argv[4:])
+        for freebase_id in differences:
+            print("The profile of {} differs from trident".format(freebase_id))
+        print("Checked {} freebase ids, {} differ".format(len(sys.argv[4:]), len(differences)))
+        sys.exit(1 if differences else 0)
+    else:
+        print(json.dumps(get_profile_store(sys.argv[2]).get(sys.argv[3])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,373 @@
+"""
+This module implements a local label index of freebase, an alternative to elastic search for the candidates of a
+mention. The index is built once from a dump of the freebase labels and it is memory-mapped at startup, so a
+mention is looked up in the process (no elastic search node and no request for each mention).
+
+The index file has a sorted dictionary of the terms (lowercase words) of the labels and the postings of each term
+(the labels that contain it), in the order of their impact (sqrt(tf) * field_norm), so only the best
+MAX_POSTINGS_PER_TERM labels of a very common term are scored. The index is built in sorted chunks of
+BUILD_CHUNK_SIZE postings that are merged at the end, so the dump does not have to fit in memory.
+A query is scored like the default (TF-IDF) similarity of elastic search 2.x:
+    score = coord * query_norm * sum over the matched terms of (sqrt(tf) * idf^2 * field_norm)
+with idf = 1 + ln(labels / (df + 1)), field_norm = 1 / sqrt(number of terms of the label) and coord = matched terms /
+terms of the query. The best candidates are returned as {freebase_id: set(labels)}, the same as
+elasticsearch.get_best_candidates.
+
+The dump is a tab separated file (freebase_id, label), e.g. "/m/0abc\tBarack Obama", or the freebase rdf dump
+(the english names and labels are kept).
+
+Usage:
+    python label_index.py build LABEL_DUMP INDEX_FILE
+    python label_index.py search INDEX_FILE QUERY
+"""
+
+import gzip
+import heapq
+import io
+import math
+import mmap
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+from collections import defaultdict
+
+import elasticsearch as els
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+# first bytes of an index file
+MAGIC = b"LBLIDX2\n"
+# the header after MAGIC: number of labels, number of terms, offsets of the label table, the term table and the
+# postings (each term is followed by its postings)
+HEADER = struct.Struct("<IIQQQ")
+# a label: offset and length of "freebase_id\tlabel" (utf-8) and the number of its terms
+LABEL_ENTRY = struct.Struct("<QII")
+# a term: offset and length of the term (utf-8), offset of its postings and the number of labels that contain it
+TERM_ENTRY = struct.Struct("<QIQI")
+# a posting: the number of the label and the frequency of the term in the label
+POSTING = struct.Struct("<II")
+# a posting of a temporary run file of build: the length of the term, the term and (-impact, number, frequency)
+RUN_TERM = struct.Struct("<I")
+RUN_POSTING = struct.Struct("<dII")
+
+# number of postings that are sorted in memory before they are written to a temporary run file (build)
+BUILD_CHUNK_SIZE = 1000000
+# maximum number of postings of a term that are scored for a query (the postings with the best impact)
+MAX_POSTINGS_PER_TERM = 100000
+
+# number of hits that are ranked for a query (like the size of the request to elastic search)
+HITS_SIZE = 100
+
+# the words of a label or a query (the standard analyzer of elastic search splits on the non-word characters)
+TERM_PATTERN = re.compile(r"\w+", re.UNICODE)
+# a line of the freebase rdf dump
+RDF_PATTERN = re.compile(r'^<http://rdf\.freebase\.com/ns/([^>]+)>\s+<([^>]+)>\s+"(.*)"@en\s*\.\s*$')
+# an escape sequence of a literal of the rdf dump (\" \\ \uXXXX)
+ESCAPE_PATTERN = re.compile(r'\\(u[0-9A-Fa-f]{4}|.)')
+# the predicates of the rdf dump that are used as labels
+LABEL_PREDICATES = frozenset([
+    "http://rdf.freebase.com/ns/type.object.name",
+    "http://www.w3.org/2000/01/rdf-schema#label"
+])
+
+# the shared label index of each file
+_indexes = {}
+
+
+def analyze(text):
+    """
+    Splits a label or a query into terms
+    :param text: string
+    :return: a list with the lowercase terms (unicode)
+    """
+    if isinstance(text, bytes):
+        text = text.decode("utf-8", "replace")
+    return TERM_PATTERN.findall(text.lower())
+
+
+def unescape(match):
+    escape = match.group(1)
+    if escape.startswith("u") and len(escape) == 5:
+        return unichr(int(escape[1:], 16))
+    return {"n": "\n", "t": "\t", "r": "\r"}.get(escape, escape)
+
+
+def read_labels(dump_filename):
+    """
+    Reads the labels of a dump
+    :param dump_filename: the path to the dump (tab separated or rdf, optionally gzipped)
+    :return: generator of tuples (freebase_id, label) (unicode)
+    """
+    opener = gzip.open if dump_filename.endswith(".gz") else io.open
+    with opener(dump_filename, "rb") as dump:
+        for line in dump:
+            line = line.decode("utf-8", "replace").rstrip("\r\n")
+            if line.startswith("<"):
+                match = RDF_PATTERN.match(line)
+                if match is None or match.group(2) not in LABEL_PREDICATES:
+                    continue
+                # m.0abc -> /m/0abc (the freebase_id of elastic search)
+                freebase_id = "/" + match.group(1).replace(".", "/", 1)
+                label = ESCAPE_PATTERN.sub(unescape, match.group(3))
+            else:
+                fields = line.split("\t")
+                if len(fields) < 2:
+                    continue
+                freebase_id, label = fields[0], fields[1]
+            if label:
+                yield freebase_id, label
+
+
+def write_run(postings, directory):
+    """
+    Sorts a chunk of postings and writes it to a temporary run file
+    :param postings: a list with tuples (term (utf-8), -impact, number, frequency)
+    :param directory: the folder of the temporary file
+    :return: the run file, at its beginning
+    """
+    postings.sort()
+    run = tempfile.TemporaryFile(dir=directory)
+    for term, impact, number, frequency in postings:
+        run.write(RUN_TERM.pack(len(term)))
+        run.write(term)
+        run.write(RUN_POSTING.pack(impact, number, frequency))
+    run.seek(0)
+    return run
+
+
+def read_run(run):
+    """
+    :param run: a run file as returned from write_run
+    :return: generator of tuples (term (utf-8), -impact, number, frequency), sorted
+    """
+    while True:
+        data = run.read(RUN_TERM.size)
+        if not data:
+            break
+        term = run.read(RUN_TERM.unpack(data)[0])
+        impact, number, frequency = RUN_POSTING.unpack(run.read(RUN_POSTING.size))
+        yield term, impact, number, frequency
+
+
+def build(dump_filename, index_filename):
+    """
+    Builds the index file of a label dump. The labels are written as they are read and the postings are sorted in
+    chunks of BUILD_CHUNK_SIZE (temporary run files in the folder of the index file) that are merged at the end.
+    :param dump_filename: the path to the dump
+    :param index_filename: the path to the index file
+    :return: the number of labels
+    """
+    directory = os.path.dirname(os.path.abspath(index_filename))
+    runs = []
+    label_entries = tempfile.TemporaryFile(dir=directory)
+    term_entries = tempfile.TemporaryFile(dir=directory)
+    try:
+        with open(index_filename, "wb") as index_file:
+            index_file.write(MAGIC)
+            index_file.write(b"\0" * HEADER.size)
+
+            labels = 0
+            chunk = []
+            for number, (freebase_id, label) in enumerate(read_labels(dump_filename)):
+                terms = analyze(label)
+                data = u"{}\t{}".format(freebase_id, label).encode("utf-8")
+                label_entries.write(LABEL_ENTRY.pack(index_file.tell(), len(data), len(terms)))
+                index_file.write(data)
+                labels += 1
+
+                frequencies = {}
+                for term in terms:
+                    frequencies[term] = frequencies.get(term, 0) + 1
+                field_norm = 1.0 / math.sqrt(max(len(terms), 1))
+                for term, frequency in frequencies.items():
+                    # the best impact first in the postings of the term
+                    chunk.append((term.encode("utf-8"), -math.sqrt(frequency) * field_norm, number, frequency))
+                if len(chunk) >= BUILD_CHUNK_SIZE:
+                    runs.append(write_run(chunk, directory))
+                    chunk = []
+            if chunk:
+                runs.append(write_run(chunk, directory))
+
+            # the terms are sorted as utf-8 bytes, the order of the binary search
+            postings_offset = index_file.tell()
+            terms = 0
+            current = None
+            for term, _, number, frequency in heapq.merge(*[read_run(run) for run in runs]):
+                if term != current:
+                    if current is not None:
+                        term_entries.write(TERM_ENTRY.pack(term_offset, len(current), posting_offset, df))
+                        terms += 1
+                    current, df = term, 0
+                    term_offset = index_file.tell()
+                    index_file.write(term)
+                    posting_offset = index_file.tell()
+                index_file.write(POSTING.pack(number, frequency))
+                df += 1
+            if current is not None:
+                term_entries.write(TERM_ENTRY.pack(term_offset, len(current), posting_offset, df))
+                terms += 1
+
+            label_table = index_file.tell()
+            label_entries.seek(0)
+            shutil.copyfileobj(label_entries, index_file)
+            term_table = index_file.tell()
+            term_entries.seek(0)
+            shutil.copyfileobj(term_entries, index_file)
+
+            index_file.seek(len(MAGIC))
+            index_file.write(HEADER.pack(labels, terms, label_table, term_table, postings_offset))
+    finally:
+        for temporary_file in runs + [label_entries, term_entries]:
+            temporary_file.close()
+    return labels
+
+
+class LabelIndex(object):
+    """
+    A memory-mapped index file of freebase labels
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: the path to the index file (as written by build)
+        """
+        self.filename = filename
+        self.file = open(filename, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError("{} is not a label index file".format(filename))
+        self.labels, self.terms, self.label_table, self.term_table, _ = HEADER.unpack_from(self.data, len(MAGIC))
+
+    def find_term(self, term):
+        """
+        Finds a term in the dictionary (binary search)
+        :param term: a term as returned from analyze
+        :return: a tuple (offset of the postings, df) or None if no label contains the term
+        """
+        term = term.encode("utf-8")
+        low, high = 0, self.terms
+        while low < high:
+            middle = (low + high) // 2
+            offset, length, posting_offset, df = TERM_ENTRY.unpack_from(self.data,
+                                                                        self.term_table + middle * TERM_ENTRY.size)
+            current = self.data[offset:offset + length]
+            if current == term:
+                return posting_offset, df
+            if current < term:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def label(self, number):
+        """
+        :param number: the number of a label
+        :return: a tuple (freebase_id, label, number of terms)
+        """
+        offset, length, terms = LABEL_ENTRY.unpack_from(self.data, self.label_table + number * LABEL_ENTRY.size)
+        freebase_id, label = self.data[offset:offset + length].decode("utf-8").split("\t", 1)
+        return freebase_id, label, terms
+
+    def idf(self, df):
+        return 1.0 + math.log(float(self.labels) / (df + 1))
+
+    def search(self, query, size=HITS_SIZE):
+        """
+        Finds the labels that match the terms of a query
+        :param query: string (e.g. "Vrije University")
+        :param size: the maximum number of hits
+        :return: a list with the hits in the format of elastic search
+         ({"_score": score, "_source": {"resource": freebase_id, "label": label}}), the best first
+        """
+        query_terms = analyze(query)
+        if not query_terms:
+            return []
+
+        scores = defaultdict(float)
+        matched = defaultdict(int)
+        sum_of_squares = 0.0
+        for term in query_terms:
+            found = self.find_term(term)
+            if found is None:
+                continue
+            posting_offset, df = found
+            idf = self.idf(df)
+            sum_of_squares += idf * idf
+            # the postings are in the order of their impact, so a long list is cut after its best labels
+            for position in range(min(df, MAX_POSTINGS_PER_TERM)):
+                number, frequency = POSTING.unpack_from(self.data, posting_offset + position * POSTING.size)
+                # the field norm is applied below
+                scores[number] += math.sqrt(frequency) * idf * idf
+                matched[number] += 1
+        if not scores:
+            return []
+
+        query_norm = 1.0 / math.sqrt(sum_of_squares)
+
+        def hit_key(number):
+            terms = LABEL_ENTRY.unpack_from(self.data, self.label_table + number * LABEL_ENTRY.size)[2]
+            score = scores[number] * query_norm * (float(matched[number]) / len(query_terms)) / math.sqrt(max(terms, 1))
+            # the best score first and the order of the dump for the same score
+            return score, -number
+
+        hits = []
+        # only the labels of the best hits are read
+        for score, number in heapq.nlargest(size, (hit_key(number) for number in scores)):
+            freebase_id, label, _ = self.label(-number)
+            hits.append({"_score": score, "_source": {"resource": freebase_id, "label": label}})
+        return hits
+
+    def get_best_candidates(self, query, results_No=10):
+        """
+        Finds the best candidates of a query, as elasticsearch.get_best_candidates
+        :param query: string (e.g. "Vrije University")
+        :param results_No: the number of the hits that are kept
+        :return: a dictionary {freebase_id: set(labels)}
+        """
+        return els.select_best_candidates(self.search(query), results_No)
+
+    def get_best_candidates_batch(self, queries, results_No=10):
+        """
+        :param queries: a list with strings
+        :param results_No: the number of the candidates of each query
+        :return: a list with the best candidates of each query ({freebase_id: set(labels)}), in the order of the queries
+        """
+        return [self.get_best_candidates(query, results_No) for query in queries]
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+def get_label_index(filename):
+    """
+    Returns the shared label index of a file (it is memory-mapped once)
+    :param filename: the path to the index file
+    :return: object of class LabelIndex
+    """
+    if filename not in _indexes:
+        _indexes[filename] = LabelIndex(filename)
+    return _indexes[filename]
+
+
+def main():
+    if len(sys.argv) < 4 or sys.argv[1] not in ("build", "search"):
+        print(__doc__)
+        sys.exit(1)
+
+    if sys.argv[1] == "build":
+        print("Indexed {} labels".format(build(sys.argv[2], sys.argv[3])))
+    else:
+        for hit in get_label_index(sys.argv[2]).search(" ".join(sys.argv[3:]), 20):
+            print(u"{}\t{}\t{}".format(hit["_score"], hit["_source"]["resource"],
+                                         hit["_source"]["label"]).encode("utf-8"))
+
+
+if __name__ == '__main__':
+    main()
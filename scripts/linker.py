@@ -1,20 +1,128 @@
 import sys
+import time
 import logging
 import json
+from collections import deque
+from collections import OrderedDict
+from multiprocessing.pool import Pool, ThreadPool
 
 import elasticsearch as els
 import sparql
 import preprocessing
 import entity
+import cache
+import abstract_store
+import http_client
+import similarity
+import metrics
+import checkpoint
+import log_handlers
+import warc_reader
+import label_index
+import kb_profiles
+from pipeline import Pipeline, Stage
 
 # threshold. the similarity matching returns a score defining the similarity between the mention and the candidate.
 # If the score of the best candidate is less than the threshold then we define it as Unlinkable Mention Entity.
 # increasing this will improve the correct mappings but there is a risk of not taking into account an Entity Mention
 THRESHOLD_FOR_UNLINKABLE_MENTION = 0.2
 
+# cache for the candidates returned from elastic search (keyed by the normalized mention).
+# CANDIDATE_CACHE_SIZE is the number of mentions kept in memory.
+# CANDIDATE_CACHE_FILE is the sqlite file that keeps the cache across runs (None: memory only)
+CANDIDATE_CACHE_SIZE = 100000
+CANDIDATE_CACHE_FILE = None
+
+# source of the candidates of the mentions. "elasticsearch": the freebase labels of the elastic search node
+# (ELS_DOMAIN). "label_index": the local label index file LABEL_INDEX_FILE (built with
+# "python label_index.py build LABEL_DUMP INDEX_FILE"), so no elastic search node is needed (ELS_DOMAIN is ignored)
+CANDIDATE_SOURCE = "elasticsearch"
+LABEL_INDEX_FILE = "freebase_labels.idx"
+
+# store for the english abstracts and the nouns of each candidate (keyed by freebase_id).
+# ABSTRACT_STORE_FILE is the sqlite file that keeps the store across runs (None: memory only, at most
+# ABSTRACT_STORE_SIZE freebase_ids, the least recently used are evicted)
+ABSTRACT_STORE_FILE = None
+ABSTRACT_STORE_SIZE = 100000
+
+# source of the english abstracts and the nouns of the candidates. "trident": the sparql queries to trident (SQL_DOMAIN)
+# and the nouns are extracted from the abstracts while linking. "profiles": the profile file KB_PROFILE_FILE (built
+# with "python kb_profiles.py build ABSTRACTS_DUMP SAMEAS_DUMP PROFILE_FILE"), so the ranking does no requests and no
+# NLP. A candidate that is not in the profile file has no english abstract.
+ABSTRACT_SOURCE = "trident"
+KB_PROFILE_FILE = "kb_profiles.bin"
+
+# maximum number of freebase ids that are sent to trident in one (batch) sparql query
+SPARQL_BATCH_SIZE = 50
+
+# linking mode. "sequential": one document at a time, one request at a time.
+# "concurrent": the requests to elastic search and trident of many documents and mentions are sent in parallel
+# (at most ES_CONCURRENCY and TRIDENT_CONCURRENCY requests in flight, DOCUMENT_CONCURRENCY documents at the same time).
+# "pipeline": every step (html text, nlp, elastic search, trident, ranking) is a stage with PIPELINE_WORKERS threads
+# and a queue of at most PIPELINE_QUEUE_SIZE documents, so all the steps run at the same time (see pipeline.py).
+# The nlp runs in preprocessing.PREPROCESSING_WORKERS processes when it is more than 1.
+# The output is the same in all the modes.
+LINKING_MODE = "sequential"
+ES_CONCURRENCY = 4
+TRIDENT_CONCURRENCY = 8
+DOCUMENT_CONCURRENCY = 8
+PIPELINE_WORKERS = {"text": 1, "mentions": 1, "candidates": 4, "abstracts": 4, "ranking": 1}
+PIPELINE_QUEUE_SIZE = 16
+
+# ranking of the candidates of a mention. "all": the abstracts and the nouns of all the candidates are retrieved
+# before the ranking. "lazy": the candidates are evaluated in rounds in the order of the elastic search score. Each
+# round takes the next LAZY_BATCH_SIZE candidates of every mention of the document that is not decided yet and
+# retrieves their abstracts with the batched queries (the abstracts and the nouns of the other candidates are not
+# retrieved). A mention is decided after LAZY_TOP_K candidates or when its best similarity score reaches the upper
+# bound of the scorer (MAX_SIMILARITY, e.g. 1.0 for SIMILARITY_SCORER = "bow"), since no later candidate can beat it:
+# the output is the same as with "all". EARLY_STOP_MARGIN (None: off) also decides a mention when its best score
+# reaches THRESHOLD_FOR_UNLINKABLE_MENTION + EARLY_STOP_MARGIN. This is a heuristic: a later candidate with a higher
+# score is not evaluated, so it changes the linking results (34 of 1912 lines with margin 0.0 on the benchmark
+# corpus).
+RANKING_MODE = "all"
+LAZY_TOP_K = 10
+LAZY_BATCH_SIZE = 5
+EARLY_STOP_MARGIN = None
+# buckets of the histogram of the candidates evaluated for each mention (lazy mode)
+EVALUATED_CANDIDATES_BUCKETS = (1, 2, 3, 4, 6, 8, 10, 15, 20)
+
+# similarity measure of a mention and a candidate. "hamming": the nouns of the abstract that are similar to the
+# mentions of the document (normalized hamming similarity above 0.8), as similarity_measure. "bow": the nouns of the
+# abstract that are equal to the mentions of the document, calculated for all the candidates of a document with one
+# sparse dot product (numpy). BOW_IDF_FILE adds idf weights to the bow scores (built with
+# "python similarity.py idf WARC_FILE IDF_FILE", None: no weights)
+SIMILARITY_SCORER = "hamming"
+BOW_IDF_FILE = None
+
+# metrics of the pipeline (time of each stage, counters, per-document latency). See metrics.py.
+# METRICS_FILE (e.g. "metrics.json") is written every METRICS_INTERVAL seconds and at the end of the run
+# (None: the metrics are only logged)
+# METRICS_FORMAT is "json" or "prometheus" (text format)
+METRICS_FILE = None
+METRICS_FORMAT = "json"
+METRICS_INTERVAL = 60
+
+# checkpoint of a run that writes its output to a file (python linker.py ELS SQL WARC_FILE OUTPUT_FILE).
+# The checkpoint is kept in OUTPUT_FILE + CHECKPOINT_SUFFIX and it is updated after the output of each document is
+# flushed to disk. Running the same command again continues after the last document of the checkpoint.
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+# logging mode. "verbose": every record of the INFO level is written to file1.log and file2.log (as before).
+# "production": the records of PRODUCTION_LOG_LEVEL are written as json lines by a background thread and only one of
+# every LOG_SAMPLE_RATE verbose records (e.g. the abstract and the nouns of each candidate) is kept. See log_handlers.py
+LOGGING_MODE = "verbose"
+PRODUCTION_LOG_LEVEL = "info"
+LOG_SAMPLE_RATE = 100
+
 #  define logger as global variable
 logger = logging.getLogger(__name__)
 
+# define the candidate cache as global variable
+candidate_cache = cache.CandidateCache(max_size=CANDIDATE_CACHE_SIZE, filename=CANDIDATE_CACHE_FILE)
+
+# define the abstract store as global variable
+kb_store = abstract_store.AbstractStore(filename=ABSTRACT_STORE_FILE, max_size=ABSTRACT_STORE_SIZE)
+
 
 ########################################################
 #                      logger functions                #
@@ -69,6 +177,104 @@ def set_logger(stream_level="info", file_level="error", log_filename="file.log")
 ########################################################
 #              elastic search functions                #
 ########################################################
+def get_cached_best_candidates(ES_DOMAIN, ES_QUERY):
+    """
+    Returns the best candidates of elastic search for the given ES_QUERY. The candidate cache is checked first and
+    elastic search is queried only for the mentions that are not cached.
+    :param ES_DOMAIN: ELS_NODE:ELS_PORT
+    :param ES_QUERY:  string (e.g. "Vrije University")
+    :return: a dictionary {freebase_id: set(labels)}
+    """
+    cached = candidate_cache.get(ES_QUERY)
+    if cached is not None:
+        metrics.get_metrics().increment("candidate_cache_hits")
+        return OrderedDict((freebase_id, set(labels)) for freebase_id, labels in cached.items())
+
+    metrics.get_metrics().increment("candidate_cache_misses")
+    best_candidates = search_best_candidates(ES_DOMAIN, ES_QUERY)
+    if best_candidates is None:
+        # the request failed (it can succeed later): no candidates for this mention, but it is not cached
+        metrics.get_metrics().increment("candidate_lookup_failures")
+        logger.warning("The candidates of %s could not be retrieved", ES_QUERY)
+        return OrderedDict()
+    candidate_cache.put(ES_QUERY, OrderedDict((freebase_id, list(labels))
+                                              for freebase_id, labels in best_candidates.items()))
+    return best_candidates
+
+
+def get_cached_best_candidates_batch(ES_DOMAIN, ES_QUERIES, map_function=map):
+    """
+    Returns the best candidates of elastic search for many queries (e.g. all the mentions of a document).
+    The candidate cache is checked first and the mentions that are not cached are sent to elastic search in _msearch
+    requests (each mention only once).
+    :param ES_DOMAIN: ELS_NODE:ELS_PORT
+    :param ES_QUERIES: a list with strings
+    :param map_function: the function that sends the _msearch requests (e.g. map of a ThreadPool for parallel requests)
+    :return: a list with dictionaries {freebase_id: set(labels)}, in the order of ES_QUERIES
+    """
+    best_candidates = {}
+    missing = []
+    for query in ES_QUERIES:
+        key = cache.normalize_mention(query)
+        if key in best_candidates:
+            continue
+        cached = candidate_cache.get(query)
+        if cached is not None:
+            best_candidates[key] = OrderedDict((freebase_id, set(labels)) for freebase_id, labels in cached.items())
+        else:
+            # placeholder until the response of elastic search
+            best_candidates[key] = None
+            missing.append(query)
+    metrics.get_metrics().increment("candidate_cache_hits", len(best_candidates) - len(missing))
+    metrics.get_metrics().increment("candidate_cache_misses", len(missing))
+
+    batch_size = els.MSEARCH_BATCH_SIZE
+    batches = [missing[start:start + batch_size] for start in range(0, len(missing), batch_size)]
+    responses = map_function(lambda batch: search_best_candidates_batch(ES_DOMAIN, batch), batches)
+    for batch, batch_candidates in zip(batches, responses):
+        for query, candidates in zip(batch, batch_candidates):
+            if candidates is None:
+                # the query failed (it can succeed later): no candidates for this mention, but it is not cached
+                metrics.get_metrics().increment("candidate_lookup_failures")
+                logger.warning("The candidates of %s could not be retrieved", query)
+                best_candidates[cache.normalize_mention(query)] = OrderedDict()
+                continue
+            best_candidates[cache.normalize_mention(query)] = candidates
+            candidate_cache.put(query, OrderedDict((freebase_id, list(labels))
+                                                   for freebase_id, labels in candidates.items()))
+
+    return [best_candidates[cache.normalize_mention(query)] for query in ES_QUERIES]
+
+
+def search_best_candidates(ES_DOMAIN, ES_QUERY):
+    """
+    Finds the best candidates of a query in the CANDIDATE_SOURCE (elastic search or the local label index)
+    :param ES_DOMAIN: ELS_NODE:ELS_PORT
+    :param ES_QUERY:  string (e.g. "Vrije University")
+    :return: a dictionary {freebase_id: set(labels)} or None if the request failed
+    """
+    if CANDIDATE_SOURCE == "label_index":
+        with metrics.get_metrics().timer("label_index_lookup"):
+            return label_index.get_label_index(LABEL_INDEX_FILE).get_best_candidates(ES_QUERY)
+    with metrics.get_metrics().timer("es_lookup"):
+        return els.get_best_candidates(ES_DOMAIN, ES_QUERY)
+
+
+def search_best_candidates_batch(ES_DOMAIN, ES_QUERIES):
+    """
+    Finds the best candidates of many queries in the CANDIDATE_SOURCE (elastic search or the local label index)
+    :param ES_DOMAIN: ELS_NODE:ELS_PORT
+    :param ES_QUERIES: a list with strings
+    :return: a list with dictionaries {freebase_id: set(labels)} (None for a query that failed), in the order of
+     ES_QUERIES
+    """
+    if CANDIDATE_SOURCE == "label_index":
+        with metrics.get_metrics().timer("label_index_lookup"):
+            return label_index.get_label_index(LABEL_INDEX_FILE).get_best_candidates_batch(ES_QUERIES)
+    with metrics.get_metrics().timer("es_lookup"):
+        return els.get_best_candidates_batch(ES_DOMAIN, ES_QUERIES)
+
+
 def find_candidates(ES_DOMAIN, ES_QUERY):
     """
     This function calls elastic search script in order to find all possible candidates for the given ELS_QUERY
@@ -76,17 +282,47 @@ def find_candidates(ES_DOMAIN, ES_QUERY):
     :param ES_QUERY:  string (e.g. "Vrije University")
     :return:
     """
-    total_entities = []
     # 2 options els.get_best_candidates() or els.search()
-    for freebase_id, labels in els.get_best_candidates(ES_DOMAIN, ES_QUERY).items():
+    return build_candidates(ES_QUERY, get_cached_best_candidates(ES_DOMAIN, ES_QUERY))
+
+
+def build_candidates(ES_QUERY, best_candidates):
+    """
+    Creates an object of class Entity for each candidate
+    :param ES_QUERY:  string (e.g. "Vrije University")
+    :param best_candidates: a dictionary {freebase_id: set(labels)}
+    :return: a list with objects of class Entity
+    """
+    total_entities = []
+    for freebase_id, labels in best_candidates.items():
         my_entity = entity.Entity(ES_QUERY)
         my_entity.freebase_id = freebase_id
         my_entity.freebase_label = labels
-        logger.info(my_entity)
+        logger.info(my_entity, extra=log_handlers.VERBOSE)
         total_entities.append(my_entity)
     return total_entities
 
 
+def find_candidates_for_document(ES_DOMAIN, document_results, map_function=map):
+    """
+    This function finds all possible candidates for each mention of a document by using batch requests to elastic search
+    :param ES_DOMAIN: ELS_NODE:ELS_PORT
+    :param document_results: the mentions of the document (list of strings)
+    :param map_function: the function that sends the requests to elastic search
+    :return: a list with tuples (mention, candidates), in the order of document_results
+    """
+    candidates_by_mention = []
+    for doc_entity, best_candidates in zip(document_results,
+                                           get_cached_best_candidates_batch(ES_DOMAIN, document_results,
+                                                                            map_function)):
+        candidates = build_candidates(doc_entity, best_candidates)
+        logger.debug("Candidates for [%s]", doc_entity)
+        log_candidates(candidates, "debug")
+        candidates_by_mention.append((doc_entity, candidates))
+    metrics.get_metrics().increment("candidates", sum(len(candidates) for _, candidates in candidates_by_mention))
+    return candidates_by_mention
+
+
 def log_candidates(candidates, verbose_level="info"):
     """
     Displays the freebase id and the labels found for each candidate
@@ -94,12 +330,12 @@ def log_candidates(candidates, verbose_level="info"):
     :param verbose_level: the level of the output that will be produced
     :return:
     """
-    if verbose_level == "info":
-        for candidate in candidates:
-            logger.info("ID: {},   LABELS: {} ".format(candidate.freebase_id, candidate.freebase_label))
-    elif verbose_level == "debug":
-        for candidate in candidates:
-            logger.debug("ID: {},   LABELS: {} ".format(candidate.freebase_id, candidate.freebase_label))
+    level = logging.INFO if verbose_level == "info" else logging.DEBUG
+    if not logger.isEnabledFor(level):
+        return
+    for candidate in candidates:
+        logger.log(level, "ID: %s,   LABELS: %s ", candidate.freebase_id, candidate.freebase_label,
+                   extra=log_handlers.VERBOSE)
 
 
 ########################################################
@@ -120,6 +356,42 @@ def get_kb_info_by_candidate(sql_domain, candidate_id):
     return sparql.sparql(sql_domain, query)
 
 
+def get_kb_info_by_candidates(sql_domain, candidate_ids, batch_size=SPARQL_BATCH_SIZE, map_function=map):
+    """
+    Gets the abstracts from trident Knowledge Base for a list of candidates. One query is sent for every batch_size
+    candidates.
+    :param sql_domain: SQL_NODE:SQL_PORT
+    :param candidate_ids: a list with the freebase_ids of the candidates as returned from elastic search
+    :param batch_size: the maximum number of candidates in one query
+    :param map_function: the function that sends the queries (e.g. map of a ThreadPool for parallel queries)
+    :return: a dictionary {freebase_id: trident_response} where each trident_response has the same form as the
+     response of get_kb_info_by_candidate
+    """
+    responses = dict((candidate_id, {"results": {"bindings": []}}) for candidate_id in candidate_ids)
+    # map the uri of the query to the freebase_id
+    uri_to_id = dict((freebase_uri(candidate_id), candidate_id) for candidate_id in candidate_ids)
+
+    queries = [build_kb_query_for_abstracts_batch(candidate_ids[start:start + batch_size])
+               for start in range(0, len(candidate_ids), batch_size)]
+    for trident_response in map_function(lambda query: sparql.sparql(sql_domain, query), queries):
+        for binding in trident_response["results"]["bindings"]:
+            candidate_id = uri_to_id.get(binding["freebase"]["value"].strip("<>"))
+            if candidate_id is not None:
+                responses[candidate_id]["results"]["bindings"].append({"abstract": binding["abstract"]})
+
+    return responses
+
+
+def freebase_uri(candidate_id):
+    """
+    Returns the uri of a candidate in freebase
+    :param candidate_id: the freebase_id of a candidate as returned from elastic search
+    :return: string (e.g. http://rdf.freebase.com/ns/m.0abc)
+    """
+    #remove first 3 characters with : m.
+    return "http://rdf.freebase.com/ns/m.{}".format(candidate_id[3:])
+
+
 def build_kb_query(candidate_id, limit=10):
     """
     Build basic query for trident
@@ -154,6 +426,24 @@ def build_kb_query_for_abstracts(candidate_id, limit=10):
     return query
 
 
+def build_kb_query_for_abstracts_batch(candidate_ids):
+    """
+    Build query for trident that finds the abstracts of many candidates (VALUES block).
+    The variable ?freebase of the results defines the candidate of each abstract.
+    :param candidate_ids: a list with the freebase_ids of the candidates as returned from elastic search
+    :return:
+    """
+    values = " ".join("<{}>".format(freebase_uri(candidate_id)) for candidate_id in candidate_ids)
+    # build query
+    query = "select distinct ?freebase ?abstract where {} " \
+            "VALUES ?freebase {} {} {} " \
+            "?s <http://www.w3.org/2002/07/owl#sameAs> ?freebase . " \
+            "?s <http://www.w3.org/2002/07/owl#sameAs> ?o ." \
+            "?o <http://dbpedia.org/ontology/abstract> ?abstract." \
+            "{}".format("{", "{", values, "}", "}")
+    return query
+
+
 def get_only_english_abstract_from_json(trident_response):
     """
     Reads a json as returned from trident and returns the abstract in English
@@ -185,6 +475,103 @@ def remove_candidates_without_abstracts(candidates):
     return new_candidates
 
 
+def fill_kb_abstracts(sql_domain, candidates, map_function=map):
+    """
+    Finds the english abstracts of the candidates (e.g. all the candidates of a document). The abstract store is
+    checked first and trident is queried (in batches) only for the candidates that are not stored. Candidates without
+    english abstract are stored as well, in order not to query them again.
+    :param sql_domain: SQL_NODE:SQL_PORT
+    :param candidates: a list with objects of class Entity
+    :param map_function: the function that sends the queries to trident
+    :return: None
+    """
+    if ABSTRACT_SOURCE == "profiles":
+        fill_kb_profiles(candidates)
+        return
+
+    missing = {}
+    for candidate in candidates:
+        stored = kb_store.get(candidate.freebase_id)
+        if stored is not None:
+            candidate.kb_abstract, candidate.kb_nouns = stored
+        else:
+            missing.setdefault(candidate.freebase_id, []).append(candidate)
+    # both counted per candidate, as the lookups of the store
+    misses = sum(map(len, missing.values()))
+    metrics.get_metrics().increment("abstract_store_hits", len(candidates) - misses)
+    metrics.get_metrics().increment("abstract_store_misses", misses)
+
+    if not missing:
+        return
+
+    logger.debug("QUERY Trident for %s candidates", len(missing))
+    with metrics.get_metrics().timer("trident_lookup"):
+        trident_responses = get_kb_info_by_candidates(sql_domain, list(missing.keys()), map_function=map_function)
+    for freebase_id, same_id_candidates in missing.items():
+        # extract only English abstract
+        english_abstracts = get_only_english_abstract_from_json(trident_responses[freebase_id])
+        for candidate in same_id_candidates:
+            candidate.kb_abstract = english_abstracts
+        if not english_abstracts:
+            # negative result
+            kb_store.put(freebase_id, [])
+
+
+def fill_kb_profiles(candidates):
+    """
+    Finds the english abstracts and the nouns of the candidates in the profile file (ABSTRACT_SOURCE = "profiles")
+    :param candidates: a list with objects of class Entity
+    :return: None
+    """
+    store = kb_profiles.get_profile_store(KB_PROFILE_FILE)
+    with metrics.get_metrics().timer("profile_lookup"):
+        for candidate in candidates:
+            profile = store.get(candidate.freebase_id)
+            if profile is None:
+                metrics.get_metrics().increment("profile_misses")
+                candidate.kb_abstract = []
+                continue
+            metrics.get_metrics().increment("profile_hits")
+            candidate.kb_abstract, candidate.kb_nouns = profile
+
+
+def fill_kb_nouns_batch(candidates):
+    """
+    Extracts the nouns from the english abstracts of many candidates (e.g. all the candidates of a document) with one
+    call of preprocessing.extract_nouns_from_texts. Candidates with stored nouns are skipped and the abstracts of
+    each freebase_id are processed once.
+    :param candidates: a list with objects of class Entity (with english abstracts)
+    :return: None
+    """
+    missing = {}
+    for candidate in candidates:
+        if candidate.kb_nouns is None:
+            missing.setdefault(candidate.freebase_id, []).append(candidate)
+    if not missing:
+        return
+
+    freebase_ids = list(missing.keys())
+    # concatenate the english abstract of each candidate
+    abstracts = [" ".join(missing[freebase_id][0].kb_abstract) for freebase_id in freebase_ids]
+    # extract the nouns from the abstracts
+    with metrics.get_metrics().timer("noun_extraction"):
+        all_kb_nouns = preprocessing.extract_nouns_from_texts(abstracts)
+    for freebase_id, kb_nouns in zip(freebase_ids, all_kb_nouns):
+        for candidate in missing[freebase_id]:
+            candidate.kb_nouns = kb_nouns
+        kb_store.put(freebase_id, missing[freebase_id][0].kb_abstract, kb_nouns)
+
+
+def fill_kb_nouns(candidate):
+    """
+    Extracts the nouns from the english abstracts of a candidate (if they are not already stored), as
+    fill_kb_nouns_batch
+    :param candidate: object of class Entity
+    :return: None
+    """
+    fill_kb_nouns_batch([candidate])
+
+
 def similarity_measure(list1, list2, threshold=0.8):
     """
     This function calculates a score based on the hamming distance between the words in the two lists.
@@ -215,71 +602,529 @@ def main():
     :return:
     """
     # set loggers
-    set_logger(stream_level="error", file_level="info", log_filename="file1.log")
-    preprocessing.set_logger(stream_level="error", file_level="info", log_filename="file2.log")
+    if LOGGING_MODE == "production":
+        log_handlers.set_production_logger(logger, "file1.log", map_logging_level(PRODUCTION_LOG_LEVEL),
+                                           LOG_SAMPLE_RATE)
+        log_handlers.set_production_logger(preprocessing.logger, "file2.log", map_logging_level(PRODUCTION_LOG_LEVEL),
+                                           LOG_SAMPLE_RATE)
+    else:
+        set_logger(stream_level="error", file_level="info", log_filename="file1.log")
+        preprocessing.set_logger(stream_level="error", file_level="info", log_filename="file2.log")
 
     try:
-        _, ELS_DOMAIN, SQL_DOMAIN, WARC_FILE = sys.argv
+        _, ELS_DOMAIN, SQL_DOMAIN, WARC_FILE = sys.argv[:4]
+        OUTPUT_FILE = sys.argv[4] if len(sys.argv) > 4 else None
     except Exception as e:
-        print('Usage: python elasticsearch.py DOMAIN QUERY')
+        print('Usage: python linker.py ELS_DOMAIN SQL_DOMAIN WARC_FILE [OUTPUT_FILE]')
         sys.exit(0)
 
+    # the output is printed, unless an output file is given (then the run is checkpointed)
+    output = sys.stdout
+    run_checkpoint = None
+    if OUTPUT_FILE:
+        run_checkpoint = checkpoint.Checkpoint(OUTPUT_FILE + CHECKPOINT_SUFFIX, WARC_FILE)
+        if run_checkpoint.load():
+            if run_checkpoint.completed:
+                logger.info("All the documents of %s are already linked in %s", WARC_FILE, OUTPUT_FILE)
+                return
+            logger.info("Resuming after document %s (offset %s, %s documents linked)",
+                        run_checkpoint.warc_id, run_checkpoint.offset, run_checkpoint.documents)
+        output = run_checkpoint.open_output(OUTPUT_FILE)
+
+    exporter = None
+    if METRICS_FILE:
+        exporter = metrics.MetricsExporter(metrics.get_metrics(), METRICS_FILE, METRICS_FORMAT, METRICS_INTERVAL)
+        exporter.start()
+
+    try:
+        link_warc(ELS_DOMAIN, SQL_DOMAIN, WARC_FILE, output, run_checkpoint)
+        if run_checkpoint is not None:
+            run_checkpoint.finish()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if exporter is not None:
+            exporter.stop()
+        logger.info("Metrics: %s", json.dumps(metrics.get_metrics().snapshot(), sort_keys=True))
+        logger.info("Candidate cache: %s", candidate_cache.stats())
+        logger.info("Abstract store: %s", kb_store.stats())
+        logger.info("Latency of requests: %s", http_client.get_client().stats())
+        candidate_cache.close()
+        kb_store.close()
+
+
+def link_warc(ELS_DOMAIN, SQL_DOMAIN, WARC_FILE, output=sys.stdout, run_checkpoint=None):
+    """
+    Links the entity mentions of all the documents of the warc file in the LINKING_MODE and prints the results
+    :param ELS_DOMAIN: ELS_NODE:ELS_PORT
+    :param SQL_DOMAIN: SQL_NODE:SQL_PORT
+    :param WARC_FILE: the path to warc file
+    :param output: the file where the results are printed
+    :param run_checkpoint: object of class Checkpoint (None: no checkpoint)
+    :return:
+    """
+    if LINKING_MODE == "concurrent":
+        link_concurrent(ELS_DOMAIN, SQL_DOMAIN, WARC_FILE, output, run_checkpoint)
+    elif LINKING_MODE == "pipeline":
+        link_pipeline(ELS_DOMAIN, SQL_DOMAIN, WARC_FILE, output, run_checkpoint)
+    else:
+        link(ELS_DOMAIN, SQL_DOMAIN, WARC_FILE, output, run_checkpoint)
+
+
+def start_offset(run_checkpoint):
+    """
+    :param run_checkpoint: object of class Checkpoint or None
+    :return: the offset of the warc file where the linking starts
+    """
+    return run_checkpoint.offset if run_checkpoint is not None else 0
+
+
+def link(ELS_DOMAIN, SQL_DOMAIN, WARC_FILE, output=sys.stdout, run_checkpoint=None):
+    """
+    Links the entity mentions of all the documents of the warc file and prints the results
+    :param ELS_DOMAIN: ELS_NODE:ELS_PORT
+    :param SQL_DOMAIN: SQL_NODE:SQL_PORT
+    :param WARC_FILE: the path to warc file
+    :param output: the file where the results are printed
+    :param run_checkpoint: object of class Checkpoint (None: no checkpoint). The linking starts after the last
+     document of the checkpoint and the checkpoint is updated after each document.
+    :return:
+    """
     # for each word in each document find the potential candidates by using elastic search.
     # For each candidate query trident KB and keep only the english abstracts from the results
-    for warc_id, document_results in preprocessing.main(WARC_FILE):
+    for warc_id, document_results, end_offset in preprocessing.preprocess_documents(
+            WARC_FILE, offset=start_offset(run_checkpoint)):
+        logger.info("============  DOCUMENT  ==============")
+        start = time.time()
+        lines = link_document(ELS_DOMAIN, SQL_DOMAIN, warc_id, document_results)
+        write_output(lines, output, run_checkpoint, warc_id, end_offset)
+        metrics.get_metrics().observe("document_seconds", time.time() - start)
+
+
+def write_output(lines, output=sys.stdout, run_checkpoint=None, warc_id=None, end_offset=None):
+    """
+    Prints the output lines of a document and updates the checkpoint
+    :param lines: a list with the output lines (warc_id, mention, freebase_id)
+    :param output: the file where the lines are printed
+    :param run_checkpoint: object of class Checkpoint or None
+    :param warc_id: the WARC-TREC-ID of the document
+    :param end_offset: the end offset of the record of the document in the warc file
+    :return: None
+    """
+    with metrics.get_metrics().timer("output"):
+        for line in lines:
+            print >> output, line
+        if run_checkpoint is not None:
+            run_checkpoint.commit(output, warc_id, end_offset)
+
+
+def link_concurrent(ELS_DOMAIN, SQL_DOMAIN, WARC_FILE, output=sys.stdout, run_checkpoint=None):
+    """
+    Links the entity mentions of all the documents of the warc file and prints the results (concurrent mode).
+    The candidates and the abstracts of up to DOCUMENT_CONCURRENCY documents are retrieved in parallel, while the
+    ranking of the documents is done in the order of the warc file. Thus the output is the same as in link().
+    :param ELS_DOMAIN: ELS_NODE:ELS_PORT
+    :param SQL_DOMAIN: SQL_NODE:SQL_PORT
+    :param WARC_FILE: the path to warc file
+    :param output: the file where the results are printed
+    :param run_checkpoint: object of class Checkpoint (None: no checkpoint)
+    :return:
+    """
+    es_pool = ThreadPool(ES_CONCURRENCY)
+    trident_pool = ThreadPool(TRIDENT_CONCURRENCY)
+    document_pool = ThreadPool(DOCUMENT_CONCURRENCY)
+
+    def fetch(document_results):
+        return fetch_document(ELS_DOMAIN, SQL_DOMAIN, document_results, es_pool.map, trident_pool.map)
+
+    def rank_next():
+        warc_id, document_results, end_offset, fetched, start = pending.popleft()
         logger.info("============  DOCUMENT  ==============")
-        for doc_entity in document_results:
-            logger.debug("===============  Elastic search ==================")
-            logger.debug("Candidates for [{}]".format(doc_entity))
-            candidates = find_candidates(ELS_DOMAIN, doc_entity)
-            log_candidates(candidates, "debug")
-            logger.debug("================End of ES -- Start of Trident=================")
+        write_output(rank_document(warc_id, document_results, fetched.get(), SQL_DOMAIN, trident_pool.map), output,
+                     run_checkpoint, warc_id, end_offset)
+        # latency from the submission of the document to its output
+        metrics.get_metrics().observe("document_seconds", time.time() - start)
+
+    # documents that are being fetched (in the order of the warc file)
+    pending = deque()
+    try:
+        for warc_id, document_results, end_offset in preprocessing.preprocess_documents(
+                WARC_FILE, offset=start_offset(run_checkpoint)):
+            pending.append((warc_id, document_results, end_offset,
+                            document_pool.apply_async(fetch, (document_results,)), time.time()))
+            # bound the documents in flight
+            if len(pending) >= DOCUMENT_CONCURRENCY:
+                rank_next()
+        while pending:
+            rank_next()
+    finally:
+        for pool in (document_pool, es_pool, trident_pool):
+            pool.close()
+            pool.join()
+
+
+def link_pipeline(ELS_DOMAIN, SQL_DOMAIN, WARC_FILE, output=sys.stdout, run_checkpoint=None):
+    """
+    Links the entity mentions of all the documents of the warc file and prints the results (pipeline mode).
+    Each document passes through the stages text -> mentions -> candidates -> abstracts -> ranking, and the stages
+    work on different documents at the same time. With preprocessing.PREPROCESSING_WORKERS > 1 the nlp of the
+    mentions stage runs in a pool of that many processes. The results are printed in the order of the warc file, so
+    the output is the same as in link().
+    :param ELS_DOMAIN: ELS_NODE:ELS_PORT
+    :param SQL_DOMAIN: SQL_NODE:SQL_PORT
+    :param WARC_FILE: the path to warc file
+    :param output: the file where the results are printed
+    :param run_checkpoint: object of class Checkpoint (None: no checkpoint)
+    :return:
+    """
+    # the worker processes of the nlp (the threads of the mentions stage wait for them)
+    pool = None
+    workers = dict(PIPELINE_WORKERS)
+    if preprocessing.PREPROCESSING_WORKERS > 1:
+        pool = Pool(preprocessing.PREPROCESSING_WORKERS, initializer=preprocessing.init_worker)
+        workers["mentions"] = max(workers["mentions"], preprocessing.PREPROCESSING_WORKERS)
+
+    # each stage gets a tuple (warc_id, end_offset, start time, ...) and returns it with the result of the stage
+
+    def text(record):
+        result = preprocessing.extract_record_text(record)
+        if result is None:
+            return None
+        warc_id, body = result
+        return warc_id, record.end_offset, time.time(), body
+
+    def mentions(item):
+        warc_id, end_offset, start, body = item
+        if pool is None:
+            return warc_id, end_offset, start, preprocessing.extract_record_mentions(body)
+        async_result = pool.apply_async(preprocessing.extract_record_mentions_in_worker, (body,))
+        return warc_id, end_offset, start, preprocessing.collect_worker_result(async_result)
+
+    def candidates(item):
+        warc_id, end_offset, start, document_results = item
+        return warc_id, end_offset, start, document_results, fetch_candidates(ELS_DOMAIN, document_results)
+
+    def abstracts(item):
+        warc_id, end_offset, start, document_results, candidates_by_mention = item
+        fetch_abstracts(SQL_DOMAIN, candidates_by_mention)
+        return warc_id, end_offset, start, document_results, candidates_by_mention
+
+    def ranking(item):
+        warc_id, end_offset, start, document_results, candidates_by_mention = item
+        return warc_id, end_offset, start, rank_document(warc_id, document_results, candidates_by_mention,
+                                                         SQL_DOMAIN)
+
+    stages = [Stage(name, function, workers[name], PIPELINE_QUEUE_SIZE)
+              for name, function in (("text", text), ("mentions", mentions), ("candidates", candidates),
+                                     ("abstracts", abstracts), ("ranking", ranking))]
+    records = metrics.get_metrics().timed_iter("warc_read",
+                                               warc_reader.read_records(WARC_FILE, offset=start_offset(run_checkpoint)))
+    try:
+        for result in Pipeline(stages).run(records):
+            # the skipped records
+            if result is None:
+                continue
+            warc_id, end_offset, start, lines = result
+            logger.info("============  DOCUMENT  ==============")
+            write_output(lines, output, run_checkpoint, warc_id, end_offset)
+            # latency from the start of the document (html text) to its output
+            metrics.get_metrics().observe("document_seconds", time.time() - start)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def link_document(ELS_DOMAIN, SQL_DOMAIN, warc_id, document_results):
+    """
+    Links the entity mentions of one document. The candidates of all the mentions are found first (in batches), then
+    the abstracts of all the candidates are retrieved from trident (in batches) and finally the best candidate of each
+    mention is selected.
+    :param ELS_DOMAIN: ELS_NODE:ELS_PORT
+    :param SQL_DOMAIN: SQL_NODE:SQL_PORT
+    :param warc_id: the WARC-TREC-ID of the document
+    :param document_results: the mentions of the document (list of strings)
+    :return: a list with the output lines (warc_id, mention, freebase_id)
+    """
+    candidates_by_mention = fetch_document(ELS_DOMAIN, SQL_DOMAIN, document_results)
+    return rank_document(warc_id, document_results, candidates_by_mention, SQL_DOMAIN)
+
+
+def aggregate_mentions(document_results):
+    """
+    Counts the occurrences of each mention of a document
+    :param document_results: the mentions of the document (list of strings)
+    :return: an ordered dictionary {mention: count}, in the order of the first occurrence
+    """
+    mention_counts = OrderedDict()
+    for doc_entity in document_results:
+        mention_counts[doc_entity] = mention_counts.get(doc_entity, 0) + 1
+    return mention_counts
+
+
+def fetch_document(ELS_DOMAIN, SQL_DOMAIN, document_results, es_map=map, trident_map=map):
+    """
+    Finds the candidates of all the mentions of one document and their english abstracts.
+    Each unique mention is looked up once.
+    :param ELS_DOMAIN: ELS_NODE:ELS_PORT
+    :param SQL_DOMAIN: SQL_NODE:SQL_PORT
+    :param document_results: the mentions of the document (list of strings)
+    :param es_map: the function that sends the requests to elastic search
+    :param trident_map: the function that sends the queries to trident
+    :return: a list with tuples (mention, candidates) for each unique mention, in the order of the first occurrence
+    """
+    candidates_by_mention = fetch_candidates(ELS_DOMAIN, document_results, es_map)
+    fetch_abstracts(SQL_DOMAIN, candidates_by_mention, trident_map)
+    return candidates_by_mention
+
+
+def fetch_candidates(ELS_DOMAIN, document_results, es_map=map):
+    """
+    Finds the candidates of all the mentions of one document (the first part of fetch_document)
+    :param ELS_DOMAIN: ELS_NODE:ELS_PORT
+    :param document_results: the mentions of the document (list of strings)
+    :param es_map: the function that sends the requests to elastic search
+    :return: a list with tuples (mention, candidates) for each unique mention, in the order of the first occurrence
+    """
+    mention_counts = aggregate_mentions(document_results)
+    logger.debug("Unique mentions: %s of %s", len(mention_counts), len(document_results))
+    metrics.get_metrics().increment("unique_mentions", len(mention_counts))
+
+    logger.debug("===============  Elastic search ==================")
+    return find_candidates_for_document(ELS_DOMAIN, list(mention_counts.keys()), es_map)
+
+
+def fetch_abstracts(SQL_DOMAIN, candidates_by_mention, trident_map=map):
+    """
+    Retrieves the english abstracts of the candidates of one document (the second part of fetch_document)
+    :param SQL_DOMAIN: SQL_NODE:SQL_PORT
+    :param candidates_by_mention: a list with tuples (mention, candidates) as returned from fetch_candidates
+    :param trident_map: the function that sends the queries to trident
+    :return: None
+    """
+    if RANKING_MODE == "lazy":
+        # the abstracts are retrieved while ranking (rank_candidates_lazy)
+        return
+    logger.debug("================End of ES -- Start of Trident=================")
+    fill_kb_abstracts(SQL_DOMAIN, [candidate for _, candidates in candidates_by_mention for candidate in candidates],
+                      trident_map)
+    logger.debug("===============  END of Trident ==================")
+
+
+def rank_document(warc_id, document_results, candidates_by_mention, SQL_DOMAIN=None, trident_map=map):
+    """
+    Selects the best candidate of each mention of one document. Each unique mention is linked once and the output
+    has one line for each occurrence of a linked mention.
+    :param warc_id: the WARC-TREC-ID of the document
+    :param document_results: the mentions of the document (list of strings)
+    :param candidates_by_mention: a list with tuples (mention, candidates) as returned from fetch_document
+    :param SQL_DOMAIN: SQL_NODE:SQL_PORT (used only with RANKING_MODE = "lazy")
+    :param trident_map: the function that sends the queries to trident (used only with RANKING_MODE = "lazy")
+    :return: a list with the output lines (warc_id, mention, freebase_id)
+    """
+    if RANKING_MODE != "lazy":
+        candidates_by_mention = [(doc_entity, remove_candidates_without_abstracts(candidates))
+                                 for doc_entity, candidates in candidates_by_mention]
+        fill_kb_nouns_batch([candidate for _, candidates in candidates_by_mention for candidate in candidates])
+    scoring_start = time.time()
+    # index of the mentions of the document for the similarity measure
+    if SIMILARITY_SCORER == "bow":
+        mention_index = similarity.BagOfWordsScorer(document_results,
+                                                    similarity.get_idf_weights(BOW_IDF_FILE) if BOW_IDF_FILE else None)
+    else:
+        mention_index = similarity.MentionIndex(document_results)
+    # the score of each freebase_id (the score depends only on the document and the candidate)
+    candidate_scores = {}
+    if RANKING_MODE == "lazy":
+        best_candidates = rank_candidates_lazy(SQL_DOMAIN, document_results, candidates_by_mention, mention_index,
+                                               candidate_scores, trident_map)
+    else:
+        # all the candidates of the document at once
+        score_candidates([candidate for _, candidates in candidates_by_mention for candidate in candidates],
+                         mention_index, candidate_scores)
+
+    # the freebase_id of each linked mention
+    linked_mentions = {}
+    for doc_entity, candidates in candidates_by_mention:
+        if RANKING_MODE == "lazy":
+            candidate_with_best_score = best_candidates.get(doc_entity)
+            # if no evaluated candidate has an english abstract move to the next word
+            if candidate_with_best_score is None:
+                continue
+        else:
             for candidate in candidates:
-                logger.debug("QUERY Trident for candidate: {} with id: {}".format(candidate.name, candidate.freebase_id))
-                trident_response = get_kb_info_by_candidate(SQL_DOMAIN, candidate.freebase_id)
-                #logger.info(json.dumps(trident_response, indent=2))
-                # extract only English abstract
-                candidate.kb_abstract = get_only_english_abstract_from_json(trident_response)
-                logger.debug("Abstract from trident: {}\n".format(candidate.kb_abstract))
-            logger.debug("===============  END of Trident ==================")
-            candidates = remove_candidates_without_abstracts(candidates)
+                logger.debug("Abstract from trident for %s: %s\n", candidate.freebase_id, candidate.kb_abstract,
+                             extra=log_handlers.VERBOSE)
             # if candidates not found (or removed) move to the next word
             if not candidates:
                 continue
-            logger.info("===============  Candidates ==================")
-            # initialise the best candidate
-            candidate_with_best_score = candidates[0]
-            for candidate in candidates:
-                # concatenate the english abstract of one candidate
-                abstract = " ".join(candidate.kb_abstract)
-                # extract the nouns from the abstract
-                candidate.kb_nouns = preprocessing.extract_nouns_from_text(abstract)
-                candidate.similarity_score = similarity_measure(document_results, candidate.kb_nouns)
-                logger.info("Candidate_id: {},   label: {},   Abstract:  \n{}\n\n Nouns: {}\n\n Score: {}\n\n\n".format(
+            candidate_with_best_score = rank_candidates(document_results, doc_entity, candidates, mention_index,
+                                                        candidate_scores)
+
+        # if the candidate has similarity score less than 0.2 then it is considered as Unlinkable Mention Entity
+        # after many experiments we conclude that the results with such a low are false positives
+        if candidate_with_best_score.similarity_score < THRESHOLD_FOR_UNLINKABLE_MENTION:
+            continue
+
+        linked_mentions[doc_entity] = candidate_with_best_score.freebase_id
+    metrics.get_metrics().add_time("scoring", time.time() - scoring_start)
+    metrics.get_metrics().increment("linked_documents")
+    metrics.get_metrics().increment("linked_mentions", len(linked_mentions))
+    metrics.get_metrics().increment("unlinkable_mentions", len(candidates_by_mention) - len(linked_mentions))
+
+    output_lines = []
+    for doc_entity in document_results:
+        if doc_entity in linked_mentions:
+            output_lines.append("{}\t{}\t{}".format(warc_id, doc_entity, linked_mentions[doc_entity]))
+
+    return output_lines
+
+
+def rank_candidates(document_results, doc_entity, candidates, mention_index=None, candidate_scores=None):
+    """
+    Calculates the similarity score of each candidate and returns the candidate with the best score
+    :param document_results: the mentions of the document (list of strings)
+    :param doc_entity: the mention (string)
+    :param candidates: a list with objects of class Entity (with english abstracts)
+    :param mention_index: the index of the mentions of the document (object of class MentionIndex or
+     BagOfWordsScorer). If None the score is calculated by similarity_measure
+    :param candidate_scores: dictionary {freebase_id: score} with the scores already calculated for the document
+    :return: the candidate with the best score (object of class Entity)
+    """
+    if candidate_scores is None:
+        candidate_scores = {}
+    logger.info("===============  Candidates ==================", extra=log_handlers.VERBOSE)
+    # initialise the best candidate
+    candidate_with_best_score = candidates[0]
+    for candidate in candidates:
+        fill_kb_nouns(candidate)
+        score_candidate(document_results, candidate, mention_index, candidate_scores)
+        logger.info("Candidate_id: %s,   label: %s,   Abstract:  \n%s\n\n Nouns: %s\n\n Score: %s\n\n\n",
                     candidate.freebase_id,
                     candidate.freebase_label,
                     candidate.kb_abstract,
                     candidate.kb_nouns,
-                    candidate.similarity_score))
-                # check the best score from candidates
-                if candidate.similarity_score > candidate_with_best_score.similarity_score:
-                    # change best candidate
-                    candidate_with_best_score = candidate
-
-            logger.info(" -------------   Candidate with BEST score for {} -------------  ".format(doc_entity))
-            logger.info("Candidate_id: {},   label: {},   Abstract:  \n{}\n\n Nouns: {}\n\n Score: {}\n\n\n".format(
+                    candidate.similarity_score,
+                    extra=log_handlers.VERBOSE)
+        # check the best score from candidates
+        if candidate.similarity_score > candidate_with_best_score.similarity_score:
+            # change best candidate
+            candidate_with_best_score = candidate
+
+    logger.info(" -------------   Candidate with BEST score for %s -------------  ", doc_entity)
+    logger.info("Candidate_id: %s,   label: %s,   Abstract:  \n%s\n\n Nouns: %s\n\n Score: %s\n\n\n",
                 candidate_with_best_score.freebase_id,
                 candidate_with_best_score.freebase_label,
                 candidate_with_best_score.kb_abstract,
                 candidate_with_best_score.kb_nouns,
-                candidate_with_best_score.similarity_score))
+                candidate_with_best_score.similarity_score)
 
-            # if the candidate has similarity score less than 0.2 then it is considered as Unlinkable Mention Entity
-            # after many experiments we conclude that the results with such a low are false positives
-            if candidate_with_best_score.similarity_score < THRESHOLD_FOR_UNLINKABLE_MENTION:
-                continue
+    return candidate_with_best_score
+
+
+def score_candidate(document_results, candidate, mention_index=None, candidate_scores=None):
+    """
+    Calculates the similarity score of a candidate (with nouns) and sets candidate.similarity_score
+    :param document_results: the mentions of the document (list of strings)
+    :param candidate: object of class Entity
+    :param mention_index: the index of the mentions of the document (object of class MentionIndex or
+     BagOfWordsScorer). If None the score is calculated by similarity_measure
+    :param candidate_scores: dictionary {freebase_id: score} with the scores already calculated for the document
+    :return: the score (float)
+    """
+    if candidate_scores is None:
+        candidate_scores = {}
+    if candidate.freebase_id in candidate_scores:
+        candidate.similarity_score = candidate_scores[candidate.freebase_id]
+    elif mention_index is not None:
+        candidate.similarity_score = mention_index.similarity(candidate.kb_nouns)
+    else:
+        candidate.similarity_score = similarity_measure(document_results, candidate.kb_nouns)
+    candidate_scores[candidate.freebase_id] = candidate.similarity_score
+    return candidate.similarity_score
+
+
+def score_candidates(candidates, mention_index, candidate_scores):
+    """
+    Calculates the similarity scores of many candidates (with nouns) with one call of the scorer and keeps them in
+    candidate_scores. The candidates that are already scored are skipped.
+    :param candidates: a list with objects of class Entity
+    :param mention_index: the scorer of the document (object of class MentionIndex or BagOfWordsScorer)
+    :param candidate_scores: dictionary {freebase_id: score} with the scores already calculated for the document
+    :return: None
+    """
+    missing = OrderedDict()
+    for candidate in candidates:
+        if candidate.freebase_id not in candidate_scores:
+            missing[candidate.freebase_id] = candidate.kb_nouns
+    if not missing:
+        return
+    for freebase_id, score in zip(missing.keys(), mention_index.similarities(list(missing.values()))):
+        candidate_scores[freebase_id] = score
+
+
+def rank_candidates_lazy(SQL_DOMAIN, document_results, candidates_by_mention, mention_index=None,
+                         candidate_scores=None, trident_map=map):
+    """
+    Evaluates the candidates of the mentions of a document in the order of the elastic search score
+    (RANKING_MODE = "lazy"). In each round the next LAZY_BATCH_SIZE candidates of every mention that is not decided
+    yet are evaluated together: their abstracts are retrieved with the batched queries of fill_kb_abstracts and their
+    nouns are extracted with one call. A mention is decided after LAZY_TOP_K candidates, when its best score reaches
+    the upper bound of the scorer (mention_index.MAX_SIMILARITY) or, if EARLY_STOP_MARGIN is not None, when its best
+    score reaches THRESHOLD_FOR_UNLINKABLE_MENTION + EARLY_STOP_MARGIN (this can change the result).
+    :param SQL_DOMAIN: SQL_NODE:SQL_PORT
+    :param document_results: the mentions of the document (list of strings)
+    :param candidates_by_mention: a list with tuples (mention, candidates), the best elastic search score first
+    :param mention_index: the index of the mentions of the document (object of class MentionIndex or BagOfWordsScorer)
+    :param candidate_scores: dictionary {freebase_id: score} with the scores already calculated for the document
+    :param trident_map: the function that sends the queries to trident
+    :return: a dictionary {mention: the candidate with the best score (object of class Entity)}. The mentions whose
+     evaluated candidates have no english abstract are not included
+    """
+    if candidate_scores is None:
+        candidate_scores = {}
+    # the candidates of each mention that are not evaluated yet
+    remaining = OrderedDict((doc_entity, candidates[:LAZY_TOP_K])
+                            for doc_entity, candidates in candidates_by_mention if candidates)
+    evaluated = dict.fromkeys(remaining, 0)
+    # no candidate scores more than the upper bound of the scorer (None: no upper bound)
+    max_similarity = getattr(mention_index, "MAX_SIMILARITY", None)
+    best_candidates = {}
+    while remaining:
+        batches = [(doc_entity, candidates[:LAZY_BATCH_SIZE]) for doc_entity, candidates in remaining.items()]
+        # the candidates of the round, for all the mentions at once
+        round_candidates = [candidate for _, batch in batches for candidate in batch]
+        fill_kb_abstracts(SQL_DOMAIN, round_candidates, trident_map)
+        round_candidates = remove_candidates_without_abstracts(round_candidates)
+        fill_kb_nouns_batch(round_candidates)
+        score_candidates(round_candidates, mention_index, candidate_scores)
+
+        for doc_entity, batch in batches:
+            evaluated[doc_entity] += len(batch)
+            for candidate in remove_candidates_without_abstracts(batch):
+                score_candidate(document_results, candidate, mention_index, candidate_scores)
+                logger.info("Candidate_id: %s,   label: %s,   Score: %s", candidate.freebase_id,
+                            candidate.freebase_label, candidate.similarity_score, extra=log_handlers.VERBOSE)
+                # the first candidate keeps the best score in case of a tie (the best elastic search score)
+                best = best_candidates.get(doc_entity)
+                if best is None or candidate.similarity_score > best.similarity_score:
+                    best_candidates[doc_entity] = candidate
+
+            best = best_candidates.get(doc_entity)
+            rest = remaining[doc_entity][LAZY_BATCH_SIZE:]
+            if not rest or (best is not None and
+                            ((max_similarity is not None and best.similarity_score >= max_similarity) or
+                             (EARLY_STOP_MARGIN is not None and
+                              best.similarity_score >= THRESHOLD_FOR_UNLINKABLE_MENTION + EARLY_STOP_MARGIN))):
+                del remaining[doc_entity]
+            else:
+                remaining[doc_entity] = rest
 
-            print "{}\t{}\t{}".format(warc_id, doc_entity, candidate_with_best_score.freebase_id)
+    for doc_entity, count in evaluated.items():
+        logger.info("Evaluated %s candidates for %s", count, doc_entity)
+        metrics.get_metrics().observe("evaluated_candidates_per_mention", count, EVALUATED_CANDIDATES_BUCKETS)
+    metrics.get_metrics().increment("evaluated_candidates", sum(evaluated.values()))
+    return best_candidates
 
 
 if __name__ == '__main__':
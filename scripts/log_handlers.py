@@ -0,0 +1,167 @@
+"""
+This module implements the production logging mode of the linker.
+The log records are put in a bounded queue by the threads of the pipeline and they are formatted and written to the
+log file by a background thread. The verbose records (e.g. one record for each candidate with its abstract) are
+sampled and the records are written as compact json lines. The messages use lazy formatting
+(logger.info("ID: %s", warc_id)), so a message is built only if its record is written.
+"""
+
+import atexit
+import itertools
+import json
+import logging
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# extra attribute of the verbose records, e.g. logger.info("Nouns: %s", kb_nouns, extra=log_handlers.VERBOSE)
+VERBOSE = {"verbose": True}
+
+# maximum number of records waiting to be written. When the queue is full the records are dropped (the pipeline is
+# never blocked by logging)
+QUEUE_SIZE = 10000
+
+# the loggers in production mode: tuples (logger, queue handler, file handler)
+_production_loggers = []
+
+
+class QueueHandler(logging.Handler):
+    """
+    Puts the records in a queue. The records are not formatted in the thread of the caller.
+    """
+
+    def __init__(self, record_queue):
+        logging.Handler.__init__(self)
+        self.queue = record_queue
+        self.dropped = 0
+
+    def emit(self, record):
+        try:
+            if record.exc_info:
+                # the traceback is formatted now, since the frames change after the call
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+
+class QueueListener(object):
+    """
+    Background thread that takes the records from the queue and passes them to the handlers
+    """
+
+    def __init__(self, record_queue, *handlers):
+        self.queue = record_queue
+        self.handlers = handlers
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Writes the records that are in the queue and stops the thread
+        :return: None
+        """
+        if not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join()
+        for handler in self.handlers:
+            handler.close()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps one of every sample_rate verbose records (records with the VERBOSE attribute) and all the other records
+    """
+
+    def __init__(self, sample_rate=100):
+        logging.Filter.__init__(self)
+        self.sample_rate = sample_rate
+        # itertools.count is thread safe
+        self.counter = itertools.count()
+
+    def filter(self, record):
+        if not getattr(record, "verbose", False):
+            return True
+        return next(self.counter) % self.sample_rate == 0
+
+
+class CompactFormatter(logging.Formatter):
+    """
+    Formats a record as one json line, e.g. {"t": 1512043200.123, "level": "INFO", "logger": "linker", "msg": "..."}
+    """
+
+    def format(self, record):
+        entry = {
+            "t": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry)
+
+
+def set_production_logger(logger, log_filename="file.log", level=logging.INFO, sample_rate=100):
+    """
+    Sets a logger in the production mode: the records of the level (and above) are written as json lines to the log
+    file by a background thread, the verbose records are sampled and the errors are also printed
+    :param logger: the logger (e.g. the global logger of linker.py)
+    :param log_filename: the path to the file that logs will be stored
+    :param level: logging level (e.g. logging.INFO). The calls with lower level return without creating a record
+    :param sample_rate: one of every sample_rate verbose records is written (1: all the records)
+    :return: object of class QueueListener (it is stopped at exit)
+    """
+    file_handler = logging.FileHandler(log_filename)
+    file_handler.setFormatter(CompactFormatter())
+
+    record_queue = queue.Queue(QUEUE_SIZE)
+    listener = QueueListener(record_queue, file_handler).start()
+    atexit.register(listener.stop)
+
+    # the errors are printed directly (they are rare)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setLevel(logging.ERROR)
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    queue_handler = QueueHandler(record_queue)
+    logger.setLevel(level)
+    logger.addFilter(SamplingFilter(sample_rate))
+    logger.addHandler(queue_handler)
+    logger.addHandler(stream_handler)
+    logger.propagate = False
+    _production_loggers.append((logger, queue_handler, file_handler))
+    return listener
+
+
+def use_direct_handlers():
+    """
+    Replaces the queue handlers of the production loggers with their file handlers. It is called in a forked worker
+    process, where the background thread of the queue does not exist.
+    :return: None
+    """
+    for logger, queue_handler, file_handler in _production_loggers:
+        logger.removeHandler(queue_handler)
+        logger.addHandler(file_handler)
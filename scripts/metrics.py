@@ -0,0 +1,278 @@
+"""
+This module implements the instrumentation of the pipeline: the time spent in each stage (warc read, html parse,
+nlp, elastic search, trident, noun extraction, scoring, output), counters (mentions, candidates, cache hits,
+unlinkable mentions) and histograms (e.g. the latency of each document).
+The metrics can be written periodically to a file as json or as Prometheus text.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# prefix of the names of the Prometheus metrics
+PROMETHEUS_PREFIX = "entity_linking"
+
+# upper bounds of the buckets of the histograms (seconds)
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+
+class Histogram(object):
+    """
+    Histogram with cumulative buckets (as the Prometheus histograms)
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        :param buckets: the upper bounds of the buckets (sorted)
+        """
+        self.buckets = tuple(float(bound) for bound in buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+    def merge(self, other):
+        """
+        Adds the observations of another histogram (dictionary as returned from as_dict) with the same buckets
+        """
+        self.count += other["count"]
+        self.sum += other["sum"]
+        self.max = max(self.max, other["max"])
+        for index, bound in enumerate(self.buckets):
+            self.counts[index] += other["buckets"].get(str(bound), 0)
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "max": self.max,
+            # cumulative counts {upper bound: count}
+            "buckets": dict((str(bound), count) for bound, count in zip(self.buckets, self.counts))
+        }
+
+
+class Metrics(object):
+    """
+    Registry with the time of each stage, the counters and the histograms. It is shared between threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # {stage: seconds}, {stage: number of calls}
+            self.stage_seconds = {}
+            self.stage_calls = {}
+            # {name: value}
+            self.counters = {}
+            # {name: Histogram}
+            self.histograms = {}
+
+    def add_time(self, stage, seconds):
+        """
+        Adds the time of one call of a stage
+        :param stage: the name of the stage (e.g. "es_lookup")
+        :param seconds: float
+        :return: None
+        """
+        with self.lock:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+            self.stage_calls[stage] = self.stage_calls.get(stage, 0) + 1
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Measures the time of the block as one call of the stage:
+            with metrics.get_metrics().timer("scoring"):
+                ...
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.time() - start)
+
+    def timed_iter(self, stage, iterable):
+        """
+        Measures the time of each next() of an iterable (e.g. the records of the warc reader) as a call of the stage
+        :param stage: the name of the stage
+        :param iterable: any iterable
+        :return: generator with the items of the iterable
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, time.time() - start)
+                return
+            self.add_time(stage, time.time() - start)
+            yield item
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS):
+        """
+        Adds a value to a histogram (the histogram is created at the first value)
+        :param name: the name of the histogram (e.g. "document_seconds")
+        :param value: float
+        :param buckets: the buckets of the histogram if it is created
+        :return: None
+        """
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def snapshot(self):
+        """
+        :return: a dictionary with all the metrics (json serializable)
+        """
+        with self.lock:
+            return {
+                "timestamp": time.time(),
+                "uptime_seconds": time.time() - self.started,
+                "stages": dict((stage, {"seconds": seconds, "calls": self.stage_calls[stage]})
+                               for stage, seconds in self.stage_seconds.items()),
+                "counters": dict(self.counters),
+                "histograms": dict((name, histogram.as_dict()) for name, histogram in self.histograms.items())
+            }
+
+    def drain(self):
+        """
+        Returns the metrics and resets them (e.g. in a worker process, in order to merge them in the main process)
+        :return: a dictionary as returned from snapshot
+        """
+        snapshot = self.snapshot()
+        self.reset()
+        return snapshot
+
+    def merge(self, snapshot):
+        """
+        Adds the metrics of another registry (e.g. the metrics of a worker process)
+        :param snapshot: a dictionary as returned from snapshot or drain
+        :return: None
+        """
+        with self.lock:
+            for stage, values in snapshot["stages"].items():
+                self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + values["seconds"]
+                self.stage_calls[stage] = self.stage_calls.get(stage, 0) + values["calls"]
+            for name, value in snapshot["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, values in snapshot["histograms"].items():
+                histogram = self.histograms.get(name)
+                if histogram is None:
+                    histogram = self.histograms[name] = Histogram(sorted(float(bound) for bound in values["buckets"]))
+                histogram.merge(values)
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        """
+        :return: the metrics in the Prometheus text format
+        """
+        snapshot = self.snapshot()
+        lines = ["# TYPE {}_stage_seconds_total counter".format(PROMETHEUS_PREFIX)]
+        for stage, values in sorted(snapshot["stages"].items()):
+            lines.append('{}_stage_seconds_total{{stage="{}"}} {}'.format(PROMETHEUS_PREFIX, stage, values["seconds"]))
+        lines.append("# TYPE {}_stage_calls_total counter".format(PROMETHEUS_PREFIX))
+        for stage, values in sorted(snapshot["stages"].items()):
+            lines.append('{}_stage_calls_total{{stage="{}"}} {}'.format(PROMETHEUS_PREFIX, stage, values["calls"]))
+
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append("# TYPE {}_{}_total counter".format(PROMETHEUS_PREFIX, name))
+            lines.append("{}_{}_total {}".format(PROMETHEUS_PREFIX, name, value))
+
+        for name, values in sorted(snapshot["histograms"].items()):
+            lines.append("# TYPE {}_{} histogram".format(PROMETHEUS_PREFIX, name))
+            for bound, count in sorted(values["buckets"].items(), key=lambda item: float(item[0])):
+                lines.append('{}_{}_bucket{{le="{}"}} {}'.format(PROMETHEUS_PREFIX, name, bound, count))
+            lines.append('{}_{}_bucket{{le="+Inf"}} {}'.format(PROMETHEUS_PREFIX, name, values["count"]))
+            lines.append("{}_{}_sum {}".format(PROMETHEUS_PREFIX, name, values["sum"]))
+            lines.append("{}_{}_count {}".format(PROMETHEUS_PREFIX, name, values["count"]))
+
+        lines.append("# TYPE {}_uptime_seconds gauge".format(PROMETHEUS_PREFIX))
+        lines.append("{}_uptime_seconds {}".format(PROMETHEUS_PREFIX, snapshot["uptime_seconds"]))
+        return "\n".join(lines) + "\n"
+
+    def write(self, filename, export_format="json"):
+        """
+        Writes the metrics to a file. The file is replaced at once, so a reader never sees a partial file.
+        :param filename: the path to the file
+        :param export_format: "json" or "prometheus"
+        :return: None
+        """
+        text = self.to_prometheus() if export_format == "prometheus" else self.to_json()
+        temporary_filename = "{}.tmp".format(filename)
+        with open(temporary_filename, "w") as metrics_file:
+            metrics_file.write(text)
+        os.rename(temporary_filename, filename)
+
+
+class MetricsExporter(object):
+    """
+    Writes the metrics to a file every interval seconds (on a background thread) and once more when it is stopped
+    """
+
+    def __init__(self, metrics, filename, export_format="json", interval=60):
+        """
+        :param metrics: object of class Metrics
+        :param filename: the path to the file
+        :param export_format: "json" or "prometheus"
+        :param interval: seconds between two writes
+        """
+        self.metrics = metrics
+        self.filename = filename
+        self.export_format = export_format
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.metrics.write(self.filename, self.export_format)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.metrics.write(self.filename, self.export_format)
+
+
+# shared metrics (created when they are first used)
+_metrics = None
+
+
+def get_metrics():
+    """
+    Returns the shared metrics of the process
+    :return: object of class Metrics
+    """
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
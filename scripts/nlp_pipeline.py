@@ -0,0 +1,161 @@
+"""
+This module implements the NLP pipeline object. All the nltk models and resources (stemmer, lemmatizer, stopwords,
+POS tagger, NER tagger, regular expressions) are loaded once and reused for every document and abstract.
+"""
+
+import re
+
+# nltk resources {name: path in nltk data}
+NLTK_RESOURCES = {
+    "punkt": "tokenizers/punkt",
+    "stopwords": "corpora/stopwords",
+    "wordnet": "corpora/wordnet",
+    "averaged_perceptron_tagger": "taggers/averaged_perceptron_tagger",
+    "maxent_ne_chunker": "chunkers/maxent_ne_chunker"
+}
+
+# stanford NER tagger
+STANFORD_NER_MODEL = '../exist-stanford-ner/resources/classifiers/english.all.3class.distsim.crf.ser.gz'
+STANFORD_NER_JAR = '../exist-stanford-ner/java/lib/stanford-ner-2015-04-20.jar'
+
+# maximum number of words in the memory of the lemmatizer (and in the memory of the normalized tokens)
+LEMMA_CACHE_SIZE = 500000
+
+
+def ensure_resources():
+    """
+    Downloads the nltk resources that are not already installed
+    :return: None
+    """
+    import nltk
+
+    for name, path in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            nltk.download(name)
+
+
+class NLPPipeline(object):
+    """
+    NLP models and resources that are loaded once
+    """
+
+    def __init__(self):
+        from nltk.stem import PorterStemmer
+        from nltk.stem import WordNetLemmatizer
+        from nltk.corpus import stopwords
+        from nltk.tag.perceptron import PerceptronTagger
+
+        self.stemmer = PorterStemmer()
+        self.lemmatizer = WordNetLemmatizer()
+        # load wordnet now and not at the first word
+        self.lemmatizer.lemmatize("warm")
+        self.stop_words = frozenset(stopwords.words('english'))
+        # the tagger of nltk.pos_tag (english)
+        self.tagger = PerceptronTagger()
+        self.ner_tagger = None
+        self.alphanumeric_pattern = re.compile('[\W_]+')
+        # the non-alphanumeric characters, the underscores and the (ascii) digits, removed with one substitution
+        self.non_letter_pattern = re.compile('[\W_0-9]+')
+        self.hex_pattern = re.compile(r'[0-9][A-F]')
+        self.lemmas = {}
+        self.normalized = {}
+        # load the punkt sentence tokenizer now and not at the first document
+        self.tokenize("Warm up.")
+
+    def tokenize(self, text_string):
+        from nltk import word_tokenize
+        return word_tokenize(text_string)
+
+    def stem(self, word_token):
+        return self.stemmer.stem(word_token)
+
+    def lemmatize(self, word_token):
+        """
+        Lemmatizes a word. The lemma of each word is kept in memory.
+        :param word_token: string
+        :return: string
+        """
+        lemma = self.lemmas.get(word_token)
+        if lemma is None:
+            if len(self.lemmas) >= LEMMA_CACHE_SIZE:
+                self.lemmas.clear()
+            lemma = self.lemmatizer.lemmatize(word_token)
+            self.lemmas[word_token] = lemma
+        return lemma
+
+    def is_stop_word(self, word_token):
+        return word_token in self.stop_words
+
+    def remove_alphanumeric(self, word_token):
+        return self.alphanumeric_pattern.sub('', word_token)
+
+    def remove_hex(self, word_token):
+        return self.hex_pattern.sub('', word_token)
+
+    def normalize(self, word_token):
+        """
+        Removes the hex numbers, lemmatizes and removes the non-alphanumeric characters and the digits of a token,
+        the same as remove_hex, lemmatize, remove_alphanumeric and the removal of the digits one after the other.
+        The result of each token is kept in memory.
+        :param word_token: string
+        :return: string (empty if nothing is left)
+        """
+        normalized = self.normalized.get(word_token)
+        if normalized is None:
+            if len(self.normalized) >= LEMMA_CACHE_SIZE:
+                self.normalized.clear()
+            normalized = self.non_letter_pattern.sub('', self.lemmatize(self.hex_pattern.sub('', word_token)))
+            if not normalized.isalpha():
+                # the non-ascii digits (\w of a unicode pattern) that isdigit removes
+                normalized = ''.join([char for char in normalized if not char.isdigit()])
+            self.normalized[word_token] = normalized
+        return normalized
+
+    def normalize_tokens(self, word_tokens):
+        """
+        Normalizes the tokens (normalize) and drops the empty ones
+        :param word_tokens: list of tokens
+        :return: list of strings
+        """
+        normalize = self.normalize
+        return [normalized for normalized in [normalize(word_token) for word_token in word_tokens] if normalized]
+
+    def pos_tag(self, word_tokens):
+        return self.tagger.tag(word_tokens)
+
+    def pos_tag_sents(self, sentences):
+        """
+        POS tags many sentences (or texts) with one call. Each list of tokens is tagged independently, one after the
+        other (PerceptronTagger.tag_sents is a loop over tag), so it takes as long as a call of pos_tag for each list
+        :param sentences: list of lists of tokens
+        :return: list of lists of tuples (token, POS)
+        """
+        return self.tagger.tag_sents(sentences)
+
+    def ner_tag(self, tokenized_text):
+        """
+        Finds the NER type of each token with the stanford NER tagger (the tagger is created at the first call)
+        :param tokenized_text: list of tokens
+        :return: list of tuples (token, NER type)
+        """
+        if self.ner_tagger is None:
+            from nltk.tag import StanfordNERTagger
+            self.ner_tagger = StanfordNERTagger(STANFORD_NER_MODEL, STANFORD_NER_JAR, encoding='utf-8')
+        return self.ner_tagger.tag(tokenized_text)
+
+
+# shared pipeline (created when it is first used)
+_pipeline = None
+
+
+def get_pipeline():
+    """
+    Returns the shared NLP pipeline
+    :return: object of class NLPPipeline
+    """
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = NLPPipeline()
+    return _pipeline
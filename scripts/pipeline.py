@@ -0,0 +1,174 @@
+"""
+This module implements a staged pipeline executor.
+Each stage has its own worker threads and a bounded input queue, so the stages run at the same time (e.g. the NLP of a
+document overlaps with the elastic search and trident requests of the previous documents) and a slow stage blocks the
+stages before it (backpressure) instead of letting the items pile up in memory. The results are returned in the
+order of the input, and the number of items in the pipeline (in the queues, in the stages and waiting for the
+results of earlier items) is limited, so a slow item does not let the finished items behind it pile up either.
+"""
+
+import threading
+import traceback
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# seconds between two checks of the stop event while a thread waits on a queue
+POLL_INTERVAL = 0.1
+
+
+class Stage(object):
+    """
+    A stage of the pipeline
+    """
+
+    def __init__(self, name, function, workers=1, queue_size=8):
+        """
+        :param name: the name of the stage (e.g. "candidates")
+        :param function: the function that is applied to each item. If it returns None the item is dropped (the
+         next stages skip it)
+        :param workers: the number of threads of the stage
+        :param queue_size: the maximum number of items waiting for the stage
+        """
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.queue_size = queue_size
+
+
+class _Failure(object):
+    """
+    An exception of a stage, passed to the output in the place of the item
+    """
+
+    def __init__(self, stage, exception):
+        self.stage = stage
+        self.exception = exception
+        self.traceback = traceback.format_exc()
+
+
+# end of the items of a queue
+_END = object()
+
+
+class Pipeline(object):
+    """
+    Runs the stages over the items of a source
+    """
+
+    def __init__(self, stages, max_in_flight=None):
+        """
+        :param stages: a list with objects of class Stage
+        :param max_in_flight: the maximum number of items between the source and the output (default: the size of
+         the queues and the workers of all the stages)
+        """
+        self.stages = stages
+        self.stopped = threading.Event()
+        # the input queue of each stage and the output queue of the last stage
+        self.queues = [queue.Queue(stage.queue_size) for stage in stages] + [queue.Queue(stages[-1].queue_size)]
+        if max_in_flight is None:
+            max_in_flight = sum(stage.queue_size + stage.workers for stage in stages) + stages[-1].queue_size
+        # one slot for each item that is taken from the source and is not returned yet (released in the order of
+        # the source, so it also limits the results that wait for an earlier item)
+        self.in_flight = queue.Queue(max(max_in_flight, 1))
+        self.lock = threading.Lock()
+        # the number of running workers of each stage
+        self.running = [stage.workers for stage in stages]
+
+    def _put(self, item_queue, item):
+        while not self.stopped.is_set():
+            try:
+                item_queue.put(item, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, item_queue):
+        while not self.stopped.is_set():
+            try:
+                return item_queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _feed(self, source):
+        """
+        Puts the items of the source in the queue of the first stage
+        """
+        try:
+            for sequence, item in enumerate(source):
+                # wait for a slot before the item enters the pipeline
+                self._put(self.in_flight, sequence)
+                if self.stopped.is_set():
+                    break
+                self._put(self.queues[0], (sequence, item))
+        except Exception as exception:
+            self._put(self.queues[0], (-1, _Failure("source", exception)))
+        for _ in range(self.stages[0].workers):
+            self._put(self.queues[0], _END)
+
+    def _work(self, index):
+        """
+        Worker of a stage: takes the items from the input queue of the stage and puts the results in the next queue
+        """
+        stage = self.stages[index]
+        while True:
+            entry = self._get(self.queues[index])
+            if entry is _END:
+                break
+            sequence, item = entry
+            if item is not None and not isinstance(item, _Failure):
+                try:
+                    item = stage.function(item)
+                except Exception as exception:
+                    item = _Failure(stage.name, exception)
+            self._put(self.queues[index + 1], (sequence, item))
+
+        with self.lock:
+            self.running[index] -= 1
+            last = self.running[index] == 0
+        if last:
+            # the next stage ends after the items of all the workers of this stage
+            workers = self.stages[index + 1].workers if index + 1 < len(self.stages) else 1
+            for _ in range(workers):
+                self._put(self.queues[index + 1], _END)
+
+    def run(self, source):
+        """
+        Runs the pipeline
+        :param source: iterable with the items (e.g. the records of a warc file)
+        :return: generator with the results of the last stage, in the order of the source. The dropped items are
+         returned as None. An exception of a stage is raised here.
+        """
+        threads = [threading.Thread(target=self._feed, args=(source,))]
+        for index, stage in enumerate(self.stages):
+            threads.extend(threading.Thread(target=self._work, args=(index,)) for _ in range(stage.workers))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        # results that arrived before the results of earlier items
+        waiting = {}
+        next_sequence = 0
+        try:
+            while True:
+                entry = self._get(self.queues[-1])
+                if entry is _END:
+                    break
+                sequence, item = entry
+                if isinstance(item, _Failure):
+                    raise RuntimeError("Stage {} failed: {!r}\n{}".format(item.stage, item.exception, item.traceback))
+                waiting[sequence] = item
+                while next_sequence in waiting:
+                    item = waiting.pop(next_sequence)
+                    # the slot of the item is free for the next item of the source
+                    self.in_flight.get_nowait()
+                    next_sequence += 1
+                    yield item
+        finally:
+            # the threads finish their current item and exit
+            self.stopped.set()
+            for thread in threads:
+                thread.join()
@@ -1,9 +1,16 @@
 import sys
+import time
 import logging
-import gzip
-import re
+from collections import deque
+from multiprocessing import Pool
 from bs4 import BeautifulSoup
 
+import warc_reader
+import html_extract
+import nlp_pipeline
+import metrics
+import log_handlers
+
 # TWO methods are implemented
 # METHOD == 2 : NER
 METHOD = 1
@@ -11,25 +18,30 @@ METHOD = 1
 # define KEYNAME for records
 KEYNAME = "WARC-TREC-ID"
 
+# extraction of the text of the html body of each record
+# "lxml": only the html body is parsed (script, style and comments are dropped while parsing)
+# "soup": the whole record is parsed by BeautifulSoup and the body is split at "Content-Type: text/html; charset=UTF-8"
+HTML_EXTRACTOR = "lxml"
+
 # install nltk prerequisites
 INSTALL_PREREQUISITES = True
 
+# number of worker processes that preprocess the records in parallel (1: no worker processes)
+PREPROCESSING_WORKERS = 1
+# maximum number of records that are queued to (or processed by) the worker processes
+PREPROCESSING_QUEUE_DEPTH = 64
+
 #  define logger as global variable
 logger = logging.getLogger(__name__)
 
 
 def prerequisites():
     """
-    Install prerequisites for nltk modules
+    Install prerequisites for nltk modules (only the ones that are not already installed)
     this function is executed only if INSTALL_PREREQUISITES=True
     :return: None
     """
-    import nltk
-    nltk.download('punkt')
-    nltk.download('stopwords')
-    nltk.download('wordnet')
-    nltk.download('averaged_perceptron_tagger')
-    nltk.download('maxent_ne_chunker')
+    nlp_pipeline.ensure_resources()
 
 
 if INSTALL_PREREQUISITES:
@@ -138,7 +150,7 @@ def split_headers(doc):
         headers, body = doc.split("Content-Type: text/html; charset=UTF-8")
     else:
         logger.warning("Missed the following document in split headers")
-        logger.warning(doc)
+        logger.warning("%s", doc, extra=log_handlers.VERBOSE)
         logger.debug("Document does not have Content-Type value")
         return None, None
 
@@ -171,8 +183,7 @@ def tokenizer(text_string):
     :param text_string:
     :return: a list with tokens
     """
-    from nltk import word_tokenize
-    tokens = word_tokenize(text_string)
+    tokens = nlp_pipeline.get_pipeline().tokenize(text_string)
     return tokens
 
 
@@ -182,11 +193,9 @@ def stemming(word_tokens):
     :param word_tokens:
     :return:
     """
-    from nltk.stem import PorterStemmer
-
-    ps = PorterStemmer()
+    pipeline = nlp_pipeline.get_pipeline()
     for word_token in word_tokens:
-        yield ps.stem(word_token)
+        yield pipeline.stem(word_token)
 
 
 def lemmatization(word_tokens):
@@ -195,11 +204,9 @@ def lemmatization(word_tokens):
     :param word_tokens:
     :return:
     """
-    from nltk.stem import WordNetLemmatizer
-
-    lemmatizer = WordNetLemmatizer()
+    pipeline = nlp_pipeline.get_pipeline()
     for word_token in word_tokens:
-        yield lemmatizer.lemmatize(word_token)
+        yield pipeline.lemmatize(word_token)
 
 
 def remove_stop_words(tagged):
@@ -208,9 +215,8 @@ def remove_stop_words(tagged):
     :param tagged: tokens as they retrieved from pos tagger (tuples)
     :return: a list with tokens (without the stop words)
     """
-    from nltk.corpus import stopwords
     # define stop words
-    stop_words = set(stopwords.words('english'))
+    stop_words = nlp_pipeline.get_pipeline().stop_words
     # filter text
     filtered_sentence = [w for w in tagged if w[0] not in stop_words]           # w = (word_token, pos)
 
@@ -223,8 +229,7 @@ def remove_alphanumeric(word_token):
     :param word_token:
     :return:
     """
-    pattern = re.compile('[\W_]+')
-    return pattern.sub('', word_token)
+    return nlp_pipeline.get_pipeline().remove_alphanumeric(word_token)
 
 
 def remove_number_from_string(word_token):
@@ -243,8 +248,7 @@ def pos_tagging(word_tokens):
     :param word_tokens:
     :return: a tuple
     """
-    from nltk import pos_tag
-    return pos_tag(word_tokens)
+    return nlp_pipeline.get_pipeline().pos_tag(word_tokens)
 
 
 def remove_hex_from_string(word_token):
@@ -253,7 +257,7 @@ def remove_hex_from_string(word_token):
     :param word_token:
     :return: string
     """
-    return re.sub(r'[0-9][A-F]', r'', word_token)
+    return nlp_pipeline.get_pipeline().remove_hex(word_token)
 
 
 def group_consecutive_groups(tagged):
@@ -278,10 +282,7 @@ def find_NER_type(tokenized_text):
     :param tokenized_text:
     :return:
     """
-    from nltk.tag import StanfordNERTagger
-    st = StanfordNERTagger('../exist-stanford-ner/resources/classifiers/english.all.3class.distsim.crf.ser.gz',
-                           '../exist-stanford-ner/java/lib/stanford-ner-2015-04-20.jar', encoding='utf-8')
-    classified_text = st.tag(tokenized_text)
+    classified_text = nlp_pipeline.get_pipeline().ner_tag(tokenized_text)
 
     return classified_text
 
@@ -310,35 +311,29 @@ def get_entities_from_pos_tagged(pos_tagged_text):
 
 ########################################################
 ########################################################
-def extract_nouns_from_text(text):
+def normalize_tokens(tokens):
     """
-    This functions uses all the aforementioned functions in order to extract the nouns (NNP) from the given text
-    :param text:
+    Removes hex numbers, lemmatizes, removes alphanumerics and numbers from the tokens and drops the empty tokens.
+    The steps are done for each token in one pass (NLPPipeline.normalize) and the result of each token is kept in
+    memory.
+    :param tokens: list of tokens
     :return: a list
     """
-    logger.debug("extracting nouns from text ...")
-    # tokenize
-    tokens = tokenizer(text)
-    tokens = [remove_hex_from_string(x) for x in tokens]
-
-    tokens_without_numbers = []
-    for token in lemmatization(tokens):  # implement stemming
-        token_without_alpha = remove_alphanumeric(token)  # remove alphanumeric
-        token_without_numbers = remove_number_from_string(token_without_alpha)
-        if token_without_numbers is not "":  # remove empty strings
-            tokens_without_numbers.append(token_without_numbers)
+    return nlp_pipeline.get_pipeline().normalize_tokens(tokens)
 
-    # ------------------------------------
-    # POS tagging
-    tagged = pos_tagging(tokens_without_numbers)
-    # ------------------------------------
 
+def extract_nouns_from_tagged(tagged):
+    """
+    Extracts the nouns (NNP) from the POS tagged tokens of a text
+    :param tagged: result of POS (tuples)
+    :return: a list
+    """
     # METHOD 2 uses the ne_chunk NER tagger
     if METHOD == 2:
         # ----------------------------------------------
         # NER tagging
         entities = get_entities_from_pos_tagged(tagged).keys()
-        logger.debug("NER tagging --- entities : {}".format(entities))
+        logger.debug("NER tagging --- entities : %s", entities)
         # ----------------------------------------------
         return entities
 
@@ -354,67 +349,253 @@ def extract_nouns_from_text(text):
         if len(tagged_word[0]) > 2 or tagged_word[0].isupper():
             tokens_after_stop_word_removal.append(tagged_word)
 
-    del tokens_without_numbers
-
     all_NNP_words = []
     for word in tokens_after_stop_word_removal:
         if word[1] == "NNP":
-            logger.info("tagged_word: ".format(word[0]))
+            logger.info("tagged_word: %s", word[0], extra=log_handlers.VERBOSE)
             all_NNP_words.append(word[0])
 
     for tagged_word in groups:
-        logger.info("tagged_word (consecutive): ".format(tagged_word))  # all are NNP
+        logger.info("tagged_word (consecutive): %s", tagged_word, extra=log_handlers.VERBOSE)  # all are NNP
         all_NNP_words.append(tagged_word)
 
     return all_NNP_words
 
 
-def main(warc_filename):
+def extract_nouns_from_text(text):
+    """
+    This functions uses all the aforementioned functions in order to extract the nouns (NNP) from the given text
+    :param text:
+    :return: a list
+    """
+    return extract_nouns_from_texts([text])[0]
+
+
+def extract_nouns_from_texts(texts):
+    """
+    Extracts the nouns (NNP) from many texts (e.g. all the candidate abstracts of a document).
+    Each text is tokenized and normalized as a whole and the token lists of all the texts are POS tagged with one
+    call (pos_tag_sents), so the nouns of a text are the same whether it is tagged alone or with other texts. The
+    tagger still tags the texts one after the other, so this is not faster than calling extract_nouns_from_text for
+    each text.
+    :param texts: list of strings
+    :return: a list with the nouns of each text, in the order of texts
+    """
+    logger.debug("extracting nouns from %s texts ...", len(texts))
+    # tokenize
+    all_tokens = [normalize_tokens(tokenizer(text)) for text in texts]
+
+    # ------------------------------------
+    # POS tagging
+    all_tagged = nlp_pipeline.get_pipeline().pos_tag_sents(all_tokens)
+    # ------------------------------------
+
+    del all_tokens
+
+    return [extract_nouns_from_tagged(tagged) for tagged in all_tagged]
+
+
+def init_worker():
+    """
+    Initializer of the worker processes. It loads the nltk models once, before the first record is processed.
+    The metrics inherited from the main process are cleared, since the metrics of each worker are merged in the main
+    process, and the logs are written directly (without the background thread of the production logging mode).
+    :return: None
+    """
+    nlp_pipeline.get_pipeline()
+    metrics.get_metrics().reset()
+    log_handlers.use_direct_handlers()
+
+
+def extract_text_with_soup(record):
+    """
+    Extracts the text of the html body of a record by parsing the whole record with BeautifulSoup
+    :param record: object of class WarcRecord
+    :return: string or None if the headers could not be split from the body
+    """
+    soup = BeautifulSoup(record.payload(), "lxml")
+    text = soup.text
+    logger.debug("%s", text, extra=log_handlers.VERBOSE)
+    logger.info("==================================")
+    # split headers from body
+    headers, body = split_headers(text)
+    # if split could not be achieved go to the nect record
+    if body is None:
+        return None
+    # # BODY preprocessing
+    # remove code blocks
+    lines = remove_code_blocks(body)
+    # join all lines together
+    return " ".join(lines)
+
+
+def process_record(record):
+    """
+    Preprocesses one record of the warc file
+    :param record: object of class WarcRecord as returned from warc_reader.read_records
+    :return: a tuple (warc_id, all_NNP_words) or None if the record is skipped
+    """
+    start = time.time()
+    result = extract_record_text(record)
+    if result is None:
+        return None
+    warc_id, body = result
+
+    all_NNP_words = extract_record_mentions(body)
+    metrics.get_metrics().observe("preprocessing_document_seconds", time.time() - start)
+    return warc_id, all_NNP_words
+
+
+def extract_record_text(record):
+    """
+    Extracts the text of the html body of a record (the first part of process_record)
+    :param record: object of class WarcRecord
+    :return: a tuple (warc_id, text) or None if the record is skipped
+    """
+    if not record.body:  # if empty
+        logger.debug("EMPTY")
+        return None
+
+    # # HEADERS preprocessing
+    warc_id = record.warc_id
+    if not warc_id:  # if empty
+        logger.debug("No ID. This file will be skipped")
+        return None
+
+    with metrics.get_metrics().timer("html_parse"):
+        if HTML_EXTRACTOR == "soup":
+            body = extract_text_with_soup(record)
+        else:
+            body = html_extract.extract_text(record.body)
+            if body is None:
+                logger.debug("Document does not have html or text content")
+    # if the text could not be extracted go to the next record
+    if body is None:
+        metrics.get_metrics().increment("skipped_documents")
+        return None
+    logger.info("ID: %s", warc_id)
+    return warc_id, body
+
+
+def extract_record_mentions(body):
+    """
+    Extracts the mentions (nouns) from the text of a record (the second part of process_record)
+    :param body: the text of the record
+    :return: a list with the mentions
+    """
+    #preprocess the text
+    with metrics.get_metrics().timer("nlp"):
+        all_NNP_words = extract_nouns_from_text(body)
+
+    metrics.get_metrics().increment("preprocessed_documents")
+    metrics.get_metrics().increment("mentions", len(all_NNP_words))
+    return all_NNP_words
+
+
+def process_record_in_worker(record):
+    """
+    Preprocesses one record in a worker process
+    :param record: object of class WarcRecord
+    :return: a tuple (result of process_record, metrics of the worker since the previous record)
+    """
+    result = process_record(record)
+    return result, metrics.get_metrics().drain()
+
+
+def extract_record_mentions_in_worker(body):
+    """
+    Extracts the mentions of the text of a record in a worker process (the nlp stage of the pipeline mode of linker.py)
+    :param body: the text of the record
+    :return: a tuple (result of extract_record_mentions, metrics of the worker since the previous call)
+    """
+    result = extract_record_mentions(body)
+    return result, metrics.get_metrics().drain()
+
+
+def collect_worker_result(async_result):
+    """
+    Waits for the result of a worker process and merges its metrics in the metrics of this process
+    :param async_result: the AsyncResult of process_record_in_worker (or extract_record_mentions_in_worker)
+    :return: the result of process_record (or extract_record_mentions)
+    """
+    result, worker_metrics = async_result.get()
+    metrics.get_metrics().merge(worker_metrics)
+    return result
+
+
+def process_records(records, workers=PREPROCESSING_WORKERS, queue_depth=PREPROCESSING_QUEUE_DEPTH):
+    """
+    Preprocesses the records in a pool of worker processes.
+    The results are returned in the order of the records and at most queue_depth records are in the pool.
+    :param records: iterable with the records of the warc file (objects of class WarcRecord)
+    :param workers: the number of worker processes (1: the records are processed in this process)
+    :param queue_depth: the maximum number of records in the pool
+    :return: generator of tuples (the end_offset of the record, the result of process_record)
+    """
+    if workers <= 1:
+        for record in records:
+            yield record.end_offset, process_record(record)
+        return
+
+    pool = Pool(workers, initializer=init_worker)
+    pending = deque()
+    try:
+        for record in records:
+            pending.append((record.end_offset, pool.apply_async(process_record_in_worker, (record,))))
+            if len(pending) >= queue_depth:
+                end_offset, async_result = pending.popleft()
+                yield end_offset, collect_worker_result(async_result)
+        while pending:
+            end_offset, async_result = pending.popleft()
+            yield end_offset, collect_worker_result(async_result)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main(warc_filename, workers=None, queue_depth=None):
     """
     Main function
     :param warc_filename: the path to warc file
+    :param workers: the number of worker processes that preprocess the records (default: PREPROCESSING_WORKERS)
+    :param queue_depth: the maximum number of records that are queued to the worker processes
+     (default: PREPROCESSING_QUEUE_DEPTH)
     :return:
     """
-    warcfile = gzip.open(warc_filename, "rt")
+    for warc_id, all_NNP_words, _ in preprocess_documents(warc_filename, workers, queue_depth):
+        if __name__ == "__main__":
+            print all_NNP_words
+        else:
+            yield warc_id, all_NNP_words
+
+
+def preprocess_documents(warc_filename, workers=None, queue_depth=None, offset=0):
+    """
+    Preprocesses the documents of a warc file, starting from an offset (e.g. the offset of a checkpoint)
+    :param warc_filename: the path to warc file
+    :param workers: the number of worker processes that preprocess the records (default: PREPROCESSING_WORKERS)
+    :param queue_depth: the maximum number of records that are queued to the worker processes
+     (default: PREPROCESSING_QUEUE_DEPTH)
+    :param offset: the (decompressed) offset of the first record that is preprocessed
+    :return: generator of tuples (warc_id, all_NNP_words, the end_offset of the record)
+    """
+    workers = workers or PREPROCESSING_WORKERS
+    queue_depth = queue_depth or PREPROCESSING_QUEUE_DEPTH
     record_no = 0
     #max_records = 10
-    for record in split_records(warcfile):
+    records = metrics.get_metrics().timed_iter("warc_read", warc_reader.read_records(warc_filename, offset=offset))
+    for end_offset, result in process_records(records, workers, queue_depth):
         #if record_no < max_records:
         record_no += 1
         #logger.debug("record_no < {}".format(max_records))
 
-        logger.info("----------- Document No {}---------------".format(record_no))
-        if not record:  # if empty
-            logger.debug("EMPTY")
-            continue
-
-        soup = BeautifulSoup(record, "lxml")
-        logger.debug(soup.text)
-        logger.info("==================================")
-        # split headers from body
-        headers, body = split_headers(soup.text)
-        # if split could not be achieved go to the nect record
-        if body is None:
+        logger.info("----------- Document No %s---------------", record_no)
+        if result is None:
             continue
-        # # HEADERS preprocessing
-        warc_id = find_id(headers)
-        if not warc_id:  # if empty
-            logger.debug("No ID. This file will be skipped")
-            continue
-        logger.info("ID: {}".format(warc_id))
-        # # BODY preprocessing
-        # remove code blocks
-        lines = remove_code_blocks(body)
-        # join all lines together
-        body = " ".join(lines)
-
-        #preprocess the text
-        all_NNP_words = extract_nouns_from_text(body)
+        warc_id, all_NNP_words = result
 
-        if __name__ == "__main__":
-            print all_NNP_words
-        else:
-            yield warc_id, all_NNP_words
+        yield warc_id, all_NNP_words, end_offset
 
         del all_NNP_words
 
@@ -42,8 +42,9 @@ if [ $# -eq 0 ]
     echo "NO arguments supplied. Using the file /var/scratch/wdps1934/wdps/data/sample.warc.gz as input"
     prun -t $TIME -v -np 1 python2 linker.py $ES_NODE:$ES_PORT $KB_NODE:$KB_PORT "/var/scratch/wdps1934/wdps/data/sample.warc.gz"
   else
-    # argument is given
-    prun -t $TIME -v -np 1 python2 linker.py $ES_NODE:$ES_PORT $KB_NODE:$KB_PORT $1
+    # argument is given. If a second argument (output file) is given the output is written to that file with a
+    # checkpoint, and running the same command again continues after the last linked document
+    prun -t $TIME -v -np 1 python2 linker.py $ES_NODE:$ES_PORT $KB_NODE:$KB_PORT $1 $2
 fi
 
 # kill elastic search server
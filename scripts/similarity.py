@@ -0,0 +1,234 @@
+"""
+This module implements a per-document index of the mentions for the similarity measure of linker.py.
+The normalized hamming similarity of two words is at most 1 - |len1 - len2| / max(len1, len2), so a word of an
+abstract is compared only with the mentions of the document with feasible length. The scores are the same as the
+scores of linker.similarity_measure.
+
+It also implements a bag of words scorer (SIMILARITY_SCORER = "bow" in linker.py) that scores all the candidates of
+a document with one sparse dot product, optionally with idf weights from the statistics of a corpus:
+    python similarity.py idf WARC_FILE IDF_FILE
+"""
+
+import json
+import math
+import sys
+from collections import Counter
+
+try:
+    from itertools import izip_longest as zip_longest
+except ImportError:
+    from itertools import zip_longest
+
+
+def hamming_similarity(word1, word2):
+    """
+    Normalized hamming similarity as calculated by textdistance.hamming.normalized_similarity
+    :param word1: string
+    :param word2: string
+    :return: float from 0 to 1
+    """
+    maximum = max(len(word1), len(word2))
+    if maximum == 0:
+        import textdistance
+        return textdistance.hamming.normalized_similarity(word1, word2)
+    if word1 == word2:
+        return 1.0
+    distance = sum([1 for char1, char2 in zip_longest(word1, word2) if char1 != char2])
+    return 1 - float(distance) / maximum
+
+
+class MentionIndex(object):
+    """
+    The mentions of a document grouped by length: {length: {mention: count}}
+    """
+
+    # the score has no upper bound (each noun of a candidate adds the mentions that are similar to it)
+    MAX_SIMILARITY = None
+
+    def __init__(self, mentions, threshold=0.8):
+        """
+        :param mentions: the mentions of the document (list of strings)
+        :param threshold: the threshold of the similarity measure
+        """
+        self.size = len(mentions)
+        self.threshold = threshold
+        self.buckets = {}
+        for mention, count in Counter(mentions).items():
+            self.buckets.setdefault(len(mention), {})[mention] = count
+        # number of similar mentions of each word of the abstracts
+        self.matches = {}
+
+    def feasible_lengths(self, length):
+        """
+        Returns the lengths of the mentions that can be similar to a word with the given length
+        :param length: the length of the word
+        :return: list of lengths
+        """
+        lengths = []
+        for mention_length in self.buckets:
+            maximum = max(mention_length, length)
+            if maximum == 0 or 1 - float(abs(mention_length - length)) / maximum > self.threshold:
+                lengths.append(mention_length)
+        return lengths
+
+    def count_matches(self, word):
+        """
+        Counts the mentions of the document that are similar to a word (above the threshold)
+        :param word: string
+        :return: int
+        """
+        matches = self.matches.get(word)
+        if matches is None:
+            matches = 0
+            for length in self.feasible_lengths(len(word)):
+                for mention, count in self.buckets[length].items():
+                    if hamming_similarity(mention, word) > self.threshold:
+                        matches += count
+            self.matches[word] = matches
+        return matches
+
+    def similarity(self, words):
+        """
+        Calculates the same score as linker.similarity_measure(mentions, words, threshold)
+        :param words: list of strings (e.g. the nouns of an abstract)
+        :return: a score (float)
+        """
+        score = 0
+        for word in words:
+            score += self.count_matches(word)
+        # calculate the normalized score
+        return float(score) / self.size
+
+    def similarities(self, word_lists):
+        """
+        :param word_lists: a list with the nouns of each candidate
+        :return: a list with the score of each candidate
+        """
+        return [self.similarity(words) for words in word_lists]
+
+
+class BagOfWordsScorer(object):
+    """
+    The mentions of a document as a count vector over the vocabulary of the document. The nouns of the candidates
+    are encoded as sparse 0/1 vectors over the same vocabulary (a noun counts once however often it is repeated, and
+    the nouns that are not mentions of the document are dropped) and the score of a candidate is the dot product of
+    the two vectors divided by the sum of the mention vector (the number of mentions). The score is the fraction of
+    the mentions of the document that appear in the nouns of the candidate, from 0 to 1 (MAX_SIMILARITY), with idf
+    weights the fraction of the weighted mentions. The cost grows with the number of the nouns of the candidates and
+    not with the number of (noun, mention) pairs.
+    """
+
+    # the score of a candidate whose nouns contain every mention of the document
+    MAX_SIMILARITY = 1.0
+
+    def __init__(self, mentions, idf_weights=None):
+        """
+        :param mentions: the mentions of the document (list of strings)
+        :param idf_weights: object of class IdfWeights (None: each match counts once)
+        """
+        import numpy
+
+        self.numpy = numpy
+        counts = Counter(mentions)
+        words = list(counts)
+        self.vocabulary = dict((word, index) for index, word in enumerate(words))
+        # the weight of a match with each word of the vocabulary
+        self.weights = numpy.array([counts[word] for word in words], dtype=float)
+        if idf_weights is not None:
+            self.weights *= numpy.array([idf_weights.weight(word) for word in words], dtype=float)
+        # the weighted number of mentions (the score of a candidate that matches every mention)
+        self.size = self.weights.sum()
+
+    def similarities(self, word_lists):
+        """
+        Scores many candidates (e.g. all the candidates of a document) with one sparse matrix - vector product
+        :param word_lists: a list with the nouns of each candidate
+        :return: a list with the score of each candidate
+        """
+        numpy = self.numpy
+        # the non-zero entries of the candidates x vocabulary 0/1 matrix (one entry for each distinct noun)
+        rows = []
+        columns = []
+        for row, words in enumerate(word_lists):
+            for column in set(self.vocabulary.get(word) for word in words):
+                if column is not None:
+                    rows.append(row)
+                    columns.append(column)
+        scores = numpy.bincount(numpy.array(rows, dtype=int), weights=self.weights[numpy.array(columns, dtype=int)],
+                                minlength=len(word_lists))
+        return (scores / self.size).tolist()
+
+    def similarity(self, words):
+        """
+        :param words: list of strings (e.g. the nouns of an abstract)
+        :return: a score (float)
+        """
+        return self.similarities([words])[0]
+
+
+class IdfWeights(object):
+    """
+    Inverse document frequency of the mentions in a corpus: weight = 1 + ln(documents / (df + 1))
+    """
+
+    def __init__(self, documents, document_frequencies):
+        """
+        :param documents: the number of documents of the corpus
+        :param document_frequencies: dictionary {word: number of documents with the word}
+        """
+        self.documents = documents
+        self.document_frequencies = document_frequencies
+
+    def weight(self, word):
+        return 1.0 + math.log(float(self.documents) / (self.document_frequencies.get(word, 0) + 1))
+
+    @classmethod
+    def build(cls, warc_filename):
+        """
+        Counts the documents of a warc file that contain each mention
+        :param warc_filename: the path to the warc file
+        :return: object of class IdfWeights
+        """
+        import preprocessing
+
+        documents = 0
+        document_frequencies = Counter()
+        for _, document_results, _ in preprocessing.preprocess_documents(warc_filename):
+            documents += 1
+            document_frequencies.update(set(document_results))
+        return cls(documents, dict(document_frequencies))
+
+    def save(self, filename):
+        with open(filename, "w") as idf_file:
+            json.dump({"documents": self.documents, "df": self.document_frequencies}, idf_file)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as idf_file:
+            state = json.load(idf_file)
+        return cls(state["documents"], state["df"])
+
+
+# the loaded idf weights of each file
+_idf_weights = {}
+
+
+def get_idf_weights(filename):
+    """
+    Returns the idf weights of a file (it is loaded once)
+    :param filename: the path to the idf file (as written by IdfWeights.save)
+    :return: object of class IdfWeights
+    """
+    if filename not in _idf_weights:
+        _idf_weights[filename] = IdfWeights.load(filename)
+    return _idf_weights[filename]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] != "idf":
+        print(__doc__)
+        sys.exit(1)
+
+    idf_weights = IdfWeights.build(sys.argv[2])
+    idf_weights.save(sys.argv[3])
+    print("Counted the mentions of {} documents".format(idf_weights.documents))
@@ -2,39 +2,21 @@
 This module is used in order to query the knowledge base
 """
 
-import requests
-import json
-import time
+import http_client
 
 
 def sparql(domain, query):
     """
-    Queries the knowledge base
+    Queries the knowledge base.
+    The request is retried (with backoff) in case of connection error, timeout or invalid json
     :param domain:
     :param query:
     :return:
     """
     url = 'http://%s/sparql' % domain
-    response = requests.post(url, data={'print': True, 'query': query})
-    if response:
-        retries = 3
-
-        while retries > 0:
-            retries = retries - 1
-            try:
-                response = response.json()
-                # print(json.dumps(response, indent=2))
-                break
-            except Exception as exception:
-                if retries > 0:
-                    # in case of connection error wait 2 second and retry
-                    time.sleep(2)
-                    continue
-                else:
-                    # if last retry fails then print the Error
-                    print(response)
-                    raise exception
-
+    response = http_client.get_client().post(url, endpoint='trident/sparql', parse_json=True,
+                                             data={'print': True, 'query': query})
+    # print(json.dumps(response, indent=2))
     return response
 
 
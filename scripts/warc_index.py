@@ -0,0 +1,446 @@
+"""
+This module implements a random-access index over (gzipped) warc files.
+For each record the index keeps its WARC-TREC-ID, its (decompressed) offset and length, and the access point of the
+record: the compressed offset of the gzip member that contains the beginning of the record and the decompressed
+offset of that member. The warc.gz files have one gzip member per record, so a record is read by seeking to its
+member and decompressing only the record.
+A warc file with one big gzip member has only one member boundary. For such files the index also keeps periodic
+checkpoints of the decompressor (zlib copy) while it is built. The checkpoints are kept in memory only (the state of
+zlib can not be saved in a file), so they are used by the reader of the same process, while the index file falls
+back to the member boundaries. recompress() rewrites a warc file with one gzip member per record.
+The index file keeps the size and the modification time of the warc file, and an index that does not match the warc
+file (e.g. the file was replaced after it was indexed) is ignored.
+
+Usage:
+    python warc_index.py build WARC_FILE
+    python warc_index.py extract WARC_FILE OUTPUT.warc.gz WARC-TREC-ID [WARC-TREC-ID ...]
+    python warc_index.py extract WARC_FILE OUTPUT.warc.gz --range START:STOP
+    python warc_index.py recompress WARC_FILE OUTPUT.warc.gz
+"""
+
+import bisect
+import io
+import logging
+import os
+import sys
+import zlib
+
+import warc_reader
+
+# suffix of the index file of a warc file
+INDEX_SUFFIX = ".idx"
+# size of the compressed chunks that are read from the warc file (bytes)
+CHUNK_SIZE = 1 << 20
+# decompressed bytes between two checkpoints of the decompressor (0: no checkpoints)
+CHECKPOINT_INTERVAL = 16 << 20
+# the first line of an index file: the size and the modification time of the warc file when it was indexed
+SIGNATURE_LINE = "#warc_size\t{}\twarc_mtime\t{}\n"
+
+#  define logger as global variable
+logger = logging.getLogger(__name__)
+
+
+class IndexEntry(object):
+    """
+    The position of a record in a warc file
+    """
+
+    def __init__(self, warc_id, offset, length, compressed_offset, member_offset):
+        """
+        :param warc_id: the WARC-TREC-ID of the record (None if the record does not have one)
+        :param offset: the (decompressed) offset of the record
+        :param length: the (decompressed) length of the record
+        :param compressed_offset: the offset in the file of the gzip member that contains the beginning of the record
+        :param member_offset: the (decompressed) offset of the beginning of that gzip member
+        """
+        self.warc_id = warc_id
+        self.offset = offset
+        self.length = length
+        self.compressed_offset = compressed_offset
+        self.member_offset = member_offset
+
+    def __str__(self):
+        return "IndexEntry____  ID: {} , OFFSET: {} , LENGTH: {} , COMPRESSED OFFSET: {}".format(
+            self.warc_id, self.offset, self.length, self.compressed_offset)
+
+
+class GzipMemberStream(io.RawIOBase):
+    """
+    Raw stream that decompresses a gzip file with many members, starting from any member boundary (or checkpoint).
+    It keeps the boundaries of the members that it decompresses and (optionally) periodic checkpoints of the
+    decompressor.
+    """
+
+    def __init__(self, fileobj, compressed_offset=0, decompressed_offset=0, decompressor=None,
+                 checkpoint_interval=0):
+        """
+        :param fileobj: the gzip file (opened in binary mode, not decompressed)
+        :param compressed_offset: the offset of the file where the decompression starts (a member boundary, or the
+         compressed offset of a checkpoint)
+        :param decompressed_offset: the decompressed offset at compressed_offset
+        :param decompressor: the decompressor of a checkpoint (None: compressed_offset is a member boundary)
+        :param checkpoint_interval: decompressed bytes between two checkpoints (0: no checkpoints)
+        """
+        super(GzipMemberStream, self).__init__()
+        self.fileobj = fileobj
+        self.fileobj.seek(compressed_offset)
+        self.compressed_position = compressed_offset
+        self.decompressed_position = decompressed_offset
+        self.decompressor = decompressor.copy() if decompressor is not None else None
+        self.checkpoint_interval = checkpoint_interval
+        self.input = b""
+        self.output = b""
+        self.position = 0
+        # (decompressed offset, compressed offset) of the beginning of each member
+        self.members = []
+        # (decompressed offset, compressed offset, decompressor)
+        self.checkpoints = []
+        self.last_access_point = decompressed_offset
+
+    def _decompress_next(self):
+        """
+        Decompresses the next chunk of the file
+        :return: False at the end of the file
+        """
+        if not self.input:
+            if (self.checkpoint_interval and self.decompressor is not None and
+                    self.decompressed_position - self.last_access_point >= self.checkpoint_interval):
+                # all the input is consumed, so the decompressor continues at compressed_position
+                self.checkpoints.append((self.decompressed_position, self.compressed_position,
+                                         self.decompressor.copy()))
+                self.last_access_point = self.decompressed_position
+            self.input = self.fileobj.read(CHUNK_SIZE)
+            if not self.input:
+                return False
+
+        if self.decompressor is None:
+            # beginning of a member
+            self.members.append((self.decompressed_position, self.compressed_position))
+            self.last_access_point = self.decompressed_position
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        data = self.decompressor.decompress(self.input)
+        unused = self.decompressor.unused_data
+        self.compressed_position += len(self.input) - len(unused)
+        self.input = unused
+        if unused:
+            # end of the member. The next member begins at the unused data
+            self.decompressor = None
+        self.decompressed_position += len(data)
+        self.output = data
+        self.position = 0
+        return True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self.position >= len(self.output):
+            if not self._decompress_next():
+                return 0
+
+        size = min(len(buffer), len(self.output) - self.position)
+        buffer[:size] = self.output[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def close(self):
+        self.fileobj.close()
+        super(GzipMemberStream, self).close()
+
+
+class WarcIndex(object):
+    """
+    The index of a warc file: a list with an IndexEntry for each record in the order of the file
+    """
+
+    def __init__(self, warc_filename, entries, checkpoints=None, signature=None):
+        """
+        :param warc_filename: the path to the warc file
+        :param entries: a list with objects of class IndexEntry
+        :param checkpoints: a list with tuples (decompressed offset, compressed offset, decompressor) (in memory only)
+        :param signature: the signature of the warc file when it was indexed (see file_signature), None if unknown
+        """
+        self.warc_filename = warc_filename
+        self.signature = signature
+        self.entries = entries
+        self.checkpoints = checkpoints or []
+        self.checkpoint_offsets = [checkpoint[0] for checkpoint in self.checkpoints]
+        self.offsets = [entry.offset for entry in entries]
+        self.positions = dict((entry.warc_id, position) for position, entry in enumerate(entries) if entry.warc_id)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @classmethod
+    def build(cls, warc_filename, checkpoint_interval=CHECKPOINT_INTERVAL):
+        """
+        Builds the index of a warc file by reading it once
+        :param warc_filename: the path to the warc file
+        :param checkpoint_interval: decompressed bytes between two checkpoints of the decompressor (0: no checkpoints)
+        :return: object of class WarcIndex
+        """
+        compressed = warc_filename.endswith(".gz")
+        signature = file_signature(warc_filename)
+        fileobj = io.open(warc_filename, "rb")
+        raw = GzipMemberStream(fileobj, checkpoint_interval=checkpoint_interval) if compressed else fileobj
+        stream = io.BufferedReader(raw, buffer_size=CHUNK_SIZE) if compressed else fileobj
+
+        entries = []
+        member_offsets = []
+        try:
+            for record in warc_reader.read_records_from_stream(stream):
+                if not compressed:
+                    entries.append(IndexEntry(record.warc_id, record.offset, record.end_offset - record.offset,
+                                              record.offset, record.offset))
+                    continue
+                # the members decompressed so far (the stream is ahead of the record)
+                member_offsets.extend(member[0] for member in raw.members[len(member_offsets):])
+                member = raw.members[bisect.bisect_right(member_offsets, record.offset) - 1]
+                entries.append(IndexEntry(record.warc_id, record.offset, record.end_offset - record.offset,
+                                          member[1], member[0]))
+        finally:
+            stream.close()
+        return cls(warc_filename, entries, raw.checkpoints if compressed else None, signature)
+
+    def save(self, index_filename=None):
+        """
+        Writes the index to a tab separated file (the checkpoints of the decompressor are not written)
+        :param index_filename: the path to the index file (default: the warc file + INDEX_SUFFIX)
+        :return: None
+        """
+        index_filename = index_filename or self.warc_filename + INDEX_SUFFIX
+        with open(index_filename, "w") as index_file:
+            if self.signature is not None:
+                index_file.write(SIGNATURE_LINE.format(*self.signature))
+            index_file.write("#warc_id\toffset\tlength\tcompressed_offset\tmember_offset\n")
+            for entry in self.entries:
+                index_file.write("{}\t{}\t{}\t{}\t{}\n".format(entry.warc_id or "-", entry.offset, entry.length,
+                                                               entry.compressed_offset, entry.member_offset))
+
+    @classmethod
+    def load(cls, warc_filename, index_filename=None):
+        """
+        Reads the index file of a warc file
+        :param warc_filename: the path to the warc file
+        :param index_filename: the path to the index file (default: the warc file + INDEX_SUFFIX)
+        :return: object of class WarcIndex
+        """
+        index_filename = index_filename or warc_filename + INDEX_SUFFIX
+        entries = []
+        signature = None
+        with open(index_filename) as index_file:
+            for line in index_file:
+                if line.startswith("#warc_size\t"):
+                    fields = line.rstrip("\n").split("\t")
+                    signature = (int(fields[1]), fields[3])
+                    continue
+                if line.startswith("#"):
+                    continue
+                warc_id, offset, length, compressed_offset, member_offset = line.rstrip("\n").split("\t")
+                entries.append(IndexEntry(None if warc_id == "-" else warc_id, int(offset), int(length),
+                                          int(compressed_offset), int(member_offset)))
+        return cls(warc_filename, entries, signature=signature)
+
+    def is_current(self):
+        """
+        Checks that the warc file has not changed since it was indexed (the same size and modification time)
+        :return: boolean (False for an index file without the signature of the warc file)
+        """
+        return self.signature is not None and self.signature == file_signature(self.warc_filename)
+
+    def position(self, key):
+        """
+        :param key: the position of the record in the file (int) or the WARC-TREC-ID of the record
+        :return: the position of the record in the file
+        """
+        if isinstance(key, int):
+            return key
+        return self.positions[key]
+
+    def find_entry(self, offset):
+        """
+        :param offset: a decompressed offset
+        :return: the entry of the record that contains the offset
+        """
+        return self.entries[max(0, bisect.bisect_right(self.offsets, offset) - 1)]
+
+    def access_point(self, entry):
+        """
+        Finds the closest point before a record where the decompression can start: the gzip member of the record or
+        a later checkpoint of the decompressor
+        :param entry: object of class IndexEntry
+        :return: a tuple (compressed offset, decompressed offset, decompressor or None)
+        """
+        position = bisect.bisect_right(self.checkpoint_offsets, entry.offset) - 1
+        if position >= 0 and self.checkpoints[position][0] > entry.member_offset:
+            decompressed_offset, compressed_offset, decompressor = self.checkpoints[position]
+            return compressed_offset, decompressed_offset, decompressor
+        return entry.compressed_offset, entry.member_offset, None
+
+
+def file_signature(warc_filename):
+    """
+    :param warc_filename: the path to the warc file
+    :return: a tuple (size, modification time) of the warc file, as they are kept in the index file
+    """
+    stat = os.stat(warc_filename)
+    return stat.st_size, "{:.6f}".format(stat.st_mtime)
+
+
+def load_index(warc_filename):
+    """
+    Loads the index file of a warc file if it matches the warc file
+    :param warc_filename: the path to the warc file
+    :return: object of class WarcIndex, or None if there is no index file or it does not match the warc file
+    """
+    if not os.path.exists(warc_filename + INDEX_SUFFIX):
+        return None
+    index = WarcIndex.load(warc_filename)
+    if not index.is_current():
+        logger.warning("The index %s does not match the size and the modification time of %s, it is ignored",
+                       warc_filename + INDEX_SUFFIX, warc_filename)
+        return None
+    return index
+
+
+def get_index(warc_filename):
+    """
+    Loads the index of a warc file, or builds it (and saves it) if the index file does not exist or it does not match
+    the warc file
+    :param warc_filename: the path to the warc file
+    :return: object of class WarcIndex
+    """
+    index = load_index(warc_filename)
+    if index is not None:
+        return index
+    index = WarcIndex.build(warc_filename)
+    index.save()
+    return index
+
+
+class IndexedWarcReader(object):
+    """
+    Reads any record or range of records of a warc file by using its index
+    """
+
+    def __init__(self, warc_filename, index=None):
+        """
+        :param warc_filename: the path to the warc file
+        :param index: object of class WarcIndex (default: the index file of the warc file, built if it is missing)
+        """
+        self.warc_filename = warc_filename
+        self.index = index or get_index(warc_filename)
+
+    def open_at(self, offset):
+        """
+        Opens the decompressed warc file at a (decompressed) offset, without decompressing the file before the access
+        point of the offset
+        :param offset: the decompressed offset (e.g. the offset of a record)
+        :return: binary file object positioned at offset
+        """
+        fileobj = io.open(self.warc_filename, "rb")
+        if not self.warc_filename.endswith(".gz"):
+            fileobj.seek(offset)
+            return fileobj
+
+        compressed_offset, decompressed_offset, decompressor = self.index.access_point(self.index.find_entry(offset))
+        stream = io.BufferedReader(GzipMemberStream(fileobj, compressed_offset, decompressed_offset, decompressor),
+                                   buffer_size=CHUNK_SIZE)
+        warc_reader.skip_bytes(stream, offset - decompressed_offset)
+        return stream
+
+    def read_range(self, start=0, stop=None):
+        """
+        Reads the records from position start up to (not including) position stop
+        :param start: the position of the first record (int) or its WARC-TREC-ID
+        :param stop: the position after the last record (int) or the WARC-TREC-ID of the record after the last
+         (None: up to the end of the file)
+        :return: generator of objects of class WarcRecord
+        """
+        start = self.index.position(start)
+        stop = len(self.index) if stop is None else self.index.position(stop)
+        if start >= stop:
+            return
+
+        offset = self.index.entries[start].offset
+        stream = self.open_at(offset)
+        try:
+            for count, record in enumerate(warc_reader.read_records_from_stream(stream, offset)):
+                if count >= stop - start:
+                    break
+                yield record
+        finally:
+            stream.close()
+
+    def read_record(self, key):
+        """
+        Reads one record
+        :param key: the position of the record (int) or its WARC-TREC-ID
+        :return: object of class WarcRecord
+        """
+        position = self.index.position(key)
+        for record in self.read_range(position, position + 1):
+            return record
+
+
+def gzip_member(data):
+    """
+    Compresses data as one gzip member
+    :param data: bytes
+    :return: bytes
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def write_records(records, output_filename):
+    """
+    Writes records to a gzipped warc file with one gzip member per record
+    :param records: iterable with objects of class WarcRecord
+    :param output_filename: the path to the output file
+    :return: the number of records
+    """
+    count = 0
+    with open(output_filename, "wb") as output_file:
+        for record in records:
+            output_file.write(gzip_member(record.to_bytes()))
+            count += 1
+    return count
+
+
+def recompress(warc_filename, output_filename):
+    """
+    Rewrites a warc file with one gzip member per record, so every record is an access point of the index
+    :param warc_filename: the path to the warc file
+    :param output_filename: the path to the output file
+    :return: the number of records
+    """
+    return write_records(warc_reader.read_records(warc_filename), output_filename)
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ("build", "extract", "recompress"):
+        print(__doc__)
+        sys.exit(1)
+
+    command, warc_filename = sys.argv[1], sys.argv[2]
+    if command == "build":
+        index = WarcIndex.build(warc_filename)
+        index.save()
+        print("Indexed {} records of {}".format(len(index), warc_filename))
+    elif command == "recompress":
+        print("Wrote {} records".format(recompress(warc_filename, sys.argv[3])))
+    else:
+        reader = IndexedWarcReader(warc_filename)
+        output_filename, keys = sys.argv[3], sys.argv[4:]
+        if keys[:1] == ["--range"]:
+            start, stop = keys[1].split(":")
+            records = reader.read_range(int(start or 0), int(stop) if stop else None)
+        else:
+            records = (reader.read_record(key) for key in keys)
+        print("Wrote {} records".format(write_records(records, output_filename)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""
+This module implements a streaming reader for (gzipped) warc files.
+Each record is sliced from the decompressed stream by using the Content-Length of its headers, so the body of a
+record can contain any text (even a "WARC/1.0" line). The decompression can run on a prefetch thread.
+"""
+
+import gzip
+import io
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# define KEYNAME for records
+KEYNAME = "WARC-TREC-ID"
+
+# size of the decompressed chunks of the prefetch thread (bytes)
+CHUNK_SIZE = 1 << 20
+# maximum number of decompressed chunks waiting to be read
+PREFETCH_DEPTH = 8
+
+
+class WarcRecord(object):
+    """
+    A record of a warc file
+    """
+
+    def __init__(self, version, headers, raw_headers, body, offset, end_offset):
+        """
+        :param version: the version line of the record (e.g. "WARC/1.0")
+        :param headers: a dictionary with the warc headers {name: value}
+        :param raw_headers: the warc headers as they are in the file (string)
+        :param body: the body of the record (Content-Length bytes)
+        :param offset: the (decompressed) offset of the record in the file
+        :param end_offset: the (decompressed) offset after the end of the record
+        """
+        self.version = version
+        self.headers = headers
+        self.raw_headers = raw_headers
+        self.body = body
+        self.offset = offset
+        self.end_offset = end_offset
+
+    @property
+    def warc_id(self):
+        """
+        :return: the WARC-TREC-ID of the record (None if the record does not have one)
+        """
+        return self.headers.get(KEYNAME)
+
+    def to_bytes(self):
+        """
+        :return: the record as it is written in a warc file
+        """
+        return self.version.encode("utf-8") + b"\r\n" + self.raw_headers + self.body + b"\r\n\r\n"
+
+    def payload(self):
+        """
+        :return: the warc headers and the body of the record, as returned from preprocessing.split_records
+        """
+        return self.raw_headers + self.body
+
+    def __str__(self):
+        return "WarcRecord____  ID: {} , OFFSET: {} , LENGTH: {}".format(self.warc_id, self.offset, len(self.body))
+
+
+class PrefetchStream(io.RawIOBase):
+    """
+    Raw stream that reads (decompresses) a file on a background thread
+    """
+
+    def __init__(self, fileobj, chunk_size=CHUNK_SIZE, depth=PREFETCH_DEPTH):
+        """
+        :param fileobj: the file that is read on the background thread (e.g. gzip file)
+        :param chunk_size: the size of the chunks that are read
+        :param depth: the maximum number of chunks that are waiting to be read
+        """
+        super(PrefetchStream, self).__init__()
+        self.fileobj = fileobj
+        self.chunks = queue.Queue(depth)
+        self.chunk = b""
+        self.position = 0
+        self.finished = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._prefetch, args=(chunk_size,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _prefetch(self, chunk_size):
+        """
+        Reads the file in chunks and puts them in the queue. An empty chunk defines the end of the file.
+        """
+        try:
+            while not self.stopped.is_set():
+                chunk = self.fileobj.read(chunk_size)
+                self._put(chunk)
+                if not chunk:
+                    break
+        except Exception as exception:
+            # the exception is raised in the thread of the reader
+            self._put(exception)
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.position >= len(self.chunk):
+            if self.finished:
+                return 0
+            chunk = self.chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                self.finished = True
+                return 0
+            self.chunk = chunk
+            self.position = 0
+
+        size = min(len(buffer), len(self.chunk) - self.position)
+        buffer[:size] = self.chunk[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def close(self):
+        """
+        Stops the background thread and closes the file after the thread has exited (it may be reading a chunk)
+        """
+        if self.closed:
+            return
+        self.stopped.set()
+        # a thread that waits for space in the queue sees the stop event sooner
+        while True:
+            try:
+                self.chunks.get_nowait()
+            except queue.Empty:
+                break
+        self.thread.join()
+        self.fileobj.close()
+        super(PrefetchStream, self).close()
+
+
+def open_warc(filename, prefetch=True):
+    """
+    Opens a (gzipped) warc file as a buffered binary stream
+    :param filename: the path to the warc file
+    :param prefetch: if True the file is decompressed on a background thread
+    :return: file object
+    """
+    fileobj = gzip.open(filename, "rb") if filename.endswith(".gz") else io.open(filename, "rb")
+    if not prefetch:
+        return fileobj
+    return io.BufferedReader(PrefetchStream(fileobj), buffer_size=CHUNK_SIZE)
+
+
+def parse_headers(raw_headers):
+    """
+    Parses the header lines of a record
+    :param raw_headers: string with header lines ("Name: value")
+    :return: a dictionary {name: value}
+    """
+    headers = {}
+    for line in raw_headers.splitlines():
+        if b":" in line:
+            name, value = line.split(b":", 1)
+            headers[name.strip().decode("utf-8", "replace")] = value.strip().decode("utf-8", "replace")
+    return headers
+
+
+def read_records_from_stream(stream, offset=0):
+    """
+    Reads the records of a decompressed warc stream
+    :param stream: binary file object positioned at the beginning of a record
+    :param offset: the (decompressed) offset of the stream position in the file
+    :return: generator of objects of class WarcRecord
+    """
+    while True:
+        line = stream.readline()
+        if not line:
+            break
+        if not line.strip() or not line.startswith(b"WARC/"):
+            # empty lines between the records
+            offset += len(line)
+            continue
+
+        record_offset = offset
+        version = line.strip().decode("utf-8", "replace")
+        offset += len(line)
+
+        header_lines = []
+        while True:
+            line = stream.readline()
+            offset += len(line)
+            header_lines.append(line)
+            if not line.strip():
+                break
+        raw_headers = b"".join(header_lines)
+        headers = parse_headers(raw_headers)
+
+        length = int(headers.get("Content-Length", 0))
+        body = stream.read(length)
+        offset += len(body)
+
+        yield WarcRecord(version, headers, raw_headers, body, record_offset, offset)
+
+
+def skip_bytes(stream, size):
+    """
+    Reads and drops the next size bytes of a stream (the bytes are not parsed)
+    :param stream: binary file object
+    :param size: the number of bytes
+    :return: the number of bytes that were skipped (less than size at the end of the stream)
+    """
+    skipped = 0
+    while skipped < size:
+        data = stream.read(min(size - skipped, CHUNK_SIZE))
+        if not data:
+            break
+        skipped += len(data)
+    return skipped
+
+
+def read_records(filename, prefetch=True, offset=0):
+    """
+    Reads the records of a (gzipped) warc file. It replaces preprocessing.split_records and preprocessing.find_id
+    (the WARC-TREC-ID of each record is in record.warc_id)
+    :param filename: the path to the warc file
+    :param prefetch: if True the file is decompressed on a background thread
+    :param offset: the (decompressed) offset of the first record that is read (e.g. the end_offset of the last record
+     of a previous run). If the warc file has an index that matches it (see warc_index.py) the reader seeks to the
+     offset, otherwise the records before the offset are decompressed but not parsed.
+    :return: generator of objects of class WarcRecord
+    """
+    import warc_index
+
+    index = warc_index.load_index(filename) if offset else None
+    if index is not None:
+        stream = warc_index.IndexedWarcReader(filename, index).open_at(offset)
+    else:
+        stream = open_warc(filename, prefetch)
+        offset = skip_bytes(stream, offset)
+    try:
+        for record in read_records_from_stream(stream, offset):
+            yield record
+    finally:
+        stream.close()